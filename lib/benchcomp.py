@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import os.path
 import re
 import subprocess
 import sys
+import tempfile
+import threading
 
 import stats
 import format
+import perfstat
+import proctree
+import rusage
 
 ################################################################################
 # Utils
@@ -85,6 +91,15 @@ class Build:
 # Tasks
 ################################################################################
 
+# The number of lines of output kept for error reports.
+TailLines = 200
+
+# How long to wait for output after the process exits, in case it has left
+# behind child processes that still hold the pipe open.
+ReaderTimeout = 10  # seconds
+
+# Output is streamed to handlers as it arrives rather than being held in
+# memory. Only the last few lines are kept, to report errors.
 class Task:
     def __init__(self, build, test, cmd, env, cwd, profilePath):
         self.build = build
@@ -94,68 +109,202 @@ class Task:
         self.cwd = cwd
         self.profilePath = profilePath
         self.running = False
-
+        self.aborted = None
+        self.follower = None
+        self.perfPath = None
+        self.usagePath = None
+        self.stable = None
+        self.outputHandlers = []
+        self.tail = collections.deque(maxlen=TailLines)
+
+    # Call |handler| with each line of the task's stdout and stderr. This
+    # happens on a separate thread while the task is running.
+    def addOutputHandler(self, handler):
+        self.outputHandlers.append(handler)
+
+    # The task runs in its own process tree so that it can be killed along
+    # with everything it started.
     def start(self):
-        self.proc = subprocess.Popen(self.cmd, env=self.env, cwd=self.cwd, text=True,
-                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if self.stable:
+            self.stable.prepareRun()
+        self.tree = proctree.ProcessTree(self.cmd, env=self.env, cwd=self.cwd, text=True,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.proc = self.tree.proc
+        self.usage = dict()
+        self.reader = threading.Thread(target=self.readOutput, daemon=True)
+        self.reader.start()
         self.running = True
 
+    def readOutput(self):
+        for line in self.proc.stdout:
+            line = line.rstrip('\n')
+            self.tail.append(line)
+            for handler in self.outputHandlers:
+                handler(line)
+
+    # Called once the main process has exited. Kill anything it left behind
+    # and collect the usage of the whole tree.
+    #
+    # The tree is killed before waiting for the reader so that nothing is
+    # left writing to the pipe. If the reader still doesn't finish, a
+    # process that escaped the tree is holding the pipe open. Closing it
+    # then would block behind the reader, so the pipe is left to the reader
+    # thread, which is a daemon and so won't keep us from exiting.
+    def finish(self):
+        self.tree.kill()
+        self.tree.writeUsage(self.usage)
+        self.tree.remove()
+        self.reader.join(ReaderTimeout)
+        if not self.reader.is_alive():
+            self.proc.stdout.close()
+        self.running = False
+
+    # Run the task under perf stat to collect performance counters.
+    def enableCounters(self):
+        error = perfstat.checkAvailable()
+        ensure(not error, error)
+        temp = tempfile.NamedTemporaryFile(delete=False)
+        temp.close()
+        self.perfPath = temp.name
+        self.cmd = perfstat.wrapCommand(self.cmd, self.perfPath)
+
+    # Run the task through the rusage shim to collect its resource usage.
+    # Call this before wrapping the command in anything else so that the
+    # shim measures the task itself.
+    def enableUsage(self):
+        temp = tempfile.NamedTemporaryFile(delete=False)
+        temp.close()
+        self.usagePath = temp.name
+        self.cmd = rusage.wrapCommand(self.cmd, self.usagePath)
+
+    # Run the task in a stableenv.StableEnvironment to reduce noise.
+    def enableStableEnvironment(self, stable):
+        self.stable = stable
+        self.cmd = stable.wrapCommand(self.cmd)
+        self.env.update(stable.env)
+
+    def writeCounters(self, result):
+        assert not self.running
+        if self.perfPath:
+            if not self.aborted:
+                perfstat.readCounters(self.perfPath, result)
+            os.remove(self.perfPath)
+            self.perfPath = None
+
+    # Resource usage of the finished task and the processes it waited for,
+    # and of the whole process tree if available.
+    def writeUsage(self, result):
+        assert not self.running
+        if self.usagePath:
+            if not self.aborted:
+                rusage.readUsage(self.usagePath, result)
+            os.remove(self.usagePath)
+            self.usagePath = None
+        result.update(self.usage)
+
     def failed(self):
         assert not self.running
         return self.proc.poll() != 0
 
     def poll(self, timeout=1):
         try:
-            self.stdout, self.stderr = self.proc.communicate(timeout=timeout)
-            self.proc.wait()
-            self.running = False
+            self.proc.wait(timeout=timeout)
         except subprocess.TimeoutExpired:
-            pass
+            return
         except:
-            self.proc.kill()
+            self.tree.close()
             self.proc.wait()
             raise
 
-    def run(self):
+        self.finish()
+
+    # Run the task to completion. If |monitor| is supplied it is called
+    # while the task is running and may return a reason to abort it.
+    def run(self, monitor=None):
         self.start()
         while self.running:
             self.poll(1)  # seconds
+            if self.running and monitor:
+                reason = monitor(self)
+                if reason:
+                    self.abort(reason)
 
-        if self.failed():
+        if not self.aborted and self.failed():
             self.reportFailedAndExit()
 
+    def abort(self, reason):
+        self.aborted = reason
+        self.tree.kill()
+        self.proc.wait()
+        self.finish()
+
     def reportFailedAndExit(self):
         print(f"Error running benchmark {self.test.name} for build {self.build.name}:")
         print(' '.join(self.cmd))
-        print('stdout:')
-        print(self.stdout)
-        print('stderr:')
-        print(self.stderr)
+        print(f'Last {len(self.tail)} lines of output:')
+        for line in self.tail:
+            print(line)
         sys.exit(1)
 
 ################################################################################
 # Test results
 ################################################################################
 
-# The results from many test runs
+# The results from many test runs, with statistics for each key that are
+# updated as results are added.
 class ResultSet:
     def __init__(self):
         self.results = dict()
-        self.stats = None
+        self.runResults = []
 
     def keys(self):
         return self.results.keys()
 
     def addResult(self, key, value):
         if key not in self.results:
-            self.results[key] = []
-        self.results[key].append(value)
+            self.results[key] = stats.Stats()
+        self.results[key].add(value)
+        self.runResults.append((key, value))
+
+    # Return the (key, value) pairs added since the last call, which are the
+    # results of the latest run.
+    def takeRunResults(self):
+        results = self.runResults
+        self.runResults = []
+        return results
+
+    def mean(self, key):
+        if key not in self.results:
+            return None
+        return self.results[key].mean
 
     def createStatsSet(self):
-        statsSet = dict()
-        for name in self.results:
-            statsSet[name] = stats.Stats(self.results[name])
-        return statsSet
+        return dict(self.results)
+
+# Return why no more runs are needed for any key tracked by |rule|, or None
+# if more are needed. Keys without results for the first build are
+# ignored. These include 'Aborted runs' since the first build's runs are
+# never aborted.
+def findStopReason(builds, rule):
+    reason = stats.StopSettled
+    statsSets = [build.results.createStatsSet() for build in builds]
+    for key in statsSets[0]:
+        if not rule.tracksKey(key):
+            continue
+        if not all(key in statsSet for statsSet in statsSets):
+            return None
+        keyReason = rule.stopReason([statsSet[key] for statsSet in statsSets])
+        if keyReason is None:
+            return None
+        if keyReason == stats.StopAtLimit:
+            reason = keyReason
+    return reason
+
+# Describe why runs stopped after |iterations| iterations.
+def describeStopReason(reason, iterations):
+    if reason == stats.StopAtLimit:
+        return f"Stopped at iteration limit without settling after {iterations} iterations"
+    return f"Results settled after {iterations} iterations"
 
 ################################################################################
 # Display
@@ -163,19 +312,38 @@ class ResultSet:
 
 CompactKeyWidth = 40
 
-def displayResults(out, builds, compact, showSamples):
+# If |maxQ| is set, only show keys where the change for some build is
+# significant at that false discovery rate. If |sortByQ| is set, show the
+# most significant changes first. If |excludeWarmup| is set, runs that look
+# like warm-up are left out of the statistics.
+def displayResults(out, builds, compact, showSamples, bootstrap = False,
+                   maxQ = None, sortByQ = False, detectDrift = False, excludeWarmup = False):
     out.clear()
 
     statsSets = dict()
     for build in builds:
         statsSets[build.name] = build.results.createStatsSet()
+        if excludeWarmup:
+            statsSets[build.name] = {key: stats.steadyState()
+                                     for key, stats in statsSets[build.name].items()}
+    detectDrift = detectDrift or excludeWarmup
 
     keysToDisplay = findAllKeys(list(statsSets.values()))
     if not keysToDisplay:
         out.print("No results to display")
         return
 
-    displayHeader(out, builds, compact)
+    qvalues = compareKeys(builds, statsSets, keysToDisplay)
+    if maxQ is not None:
+        keysToDisplay = [key for key in keysToDisplay if qvalues.get(key, 1) <= maxQ]
+    if sortByQ:
+        keysToDisplay.sort(key=lambda key: qvalues.get(key, 1))
+    adjusted = maxQ is not None or sortByQ
+
+    if bootstrap:
+        addBootstrapIntervals(builds, statsSets, keysToDisplay)
+
+    displayHeader(out, builds, compact, bootstrap, adjusted, detectDrift)
 
     for key in keysToDisplay:
         statsSetsForKey = [statsSets[build.name][key] for build in builds
@@ -200,7 +368,8 @@ def displayResults(out, builds, compact, showSamples):
                 stats = statsSets[build.name][key]
                 comp = stats.compareTo(compareTo)
 
-                line += "  " + format.formatCompactStats(stats, comp)
+                line += "  " + format.formatCompactStats(stats, comp, bootstrap, adjusted,
+                                                         detectDrift)
 
             out.print(line)
         else:
@@ -213,7 +382,7 @@ def displayResults(out, builds, compact, showSamples):
                 stats = statsSets[build.name][key]
                 comp = stats.compareTo(compareTo)
 
-                main = format.formatStats(stats, comp)
+                main = format.formatStats(stats, comp, bootstrap, adjusted, detectDrift)
 
                 box = ""
                 if not compact and minAll != maxAll and stats.count > 1:
@@ -223,8 +392,37 @@ def displayResults(out, builds, compact, showSamples):
 
                 if showSamples and minAll != maxAll:
                     samples = format.formatSamples(minAll, maxAll, stats)
-                    out.print("%76s%s" % ('', samples))
-
+                    indent = 76 + (38 if bootstrap else 0) + (14 if detectDrift else 0)
+                    out.print("%*s%s" % (indent, '', samples))
+
+
+# Compare all keys at once and return a map from each key to the smallest
+# q-value of its comparisons.
+def compareKeys(builds, statsSets, keys):
+    pairs = []
+    pairKeys = []
+    for key in keys:
+        statsForKey = [statsSets[build.name][key] for build in builds
+                       if key in statsSets[build.name]]
+        for other in statsForKey[1:]:
+            pairs.append((other, statsForKey[0]))
+            pairKeys.append(key)
+
+    qvalues = dict()
+    for key, comp in zip(pairKeys, stats.compareAll(pairs)):
+        if comp and comp.qvalue is not None:
+            qvalues[key] = min(comp.qvalue, qvalues.get(key, 1))
+    return qvalues
+
+# Calculate bootstrap intervals for all comparisons at once.
+def addBootstrapIntervals(builds, statsSets, keys):
+    pairs = []
+    for key in keys:
+        baseline = statsSets[builds[0].name].get(key)
+        for build in builds[1:]:
+            if baseline and key in statsSets[build.name]:
+                pairs.append((statsSets[build.name][key], baseline))
+    stats.addBootstrapIntervals(pairs)
 
 def findAllKeys(statsSets):
     keys = list(statsSets.pop(0).keys())
@@ -234,18 +432,19 @@ def findAllKeys(statsSets):
                 keys.append(key)
     return keys
 
-def displayHeader(out, builds, compact):
+def displayHeader(out, builds, compact, bootstrap = False, adjusted = False,
+                  detectDrift = False):
     if compact:
         buildHeader = CompactKeyWidth * " "
         header = CompactKeyWidth * " "
 
-        statsHeader = format.compactStatsHeader(False)
+        statsHeader = format.compactStatsHeader(False, withDrift=detectDrift)
         width = len(statsHeader)
         if builds:
             buildHeader += "  %*s" % (-width, builds[0].name[-width:])
             header += "  " + statsHeader
 
-        statsHeader = format.compactStatsHeader(True)
+        statsHeader = format.compactStatsHeader(True, bootstrap, adjusted, detectDrift)
         width = len(statsHeader)
         for build in builds[1:]:
             buildHeader += "  %*s" % (-width, build.name[-width:])
@@ -253,7 +452,7 @@ def displayHeader(out, builds, compact):
 
         out.print(buildHeader)
     else:
-        statsHeader = format.statsHeader()
+        statsHeader = format.statsHeader(bootstrap, adjusted, detectDrift)
         header = (24 * " ") + statsHeader
 
     out.print(header)
@@ -7,21 +7,34 @@ import ansi.cursor
 class Null:
     def print(self, text=''):
         pass
+    def status(self, text):
+        pass
     def clear(self):
         pass
 
 class Terminal:
     def __init__(self):
         self.linesDisplayed = 0
+        self.statusDisplayed = False
 
     def print(self, text=''):
         print(text)
         self.linesDisplayed += 1
+        self.statusDisplayed = False
+
+    # Display a line that is replaced by the next call to status().
+    def status(self, text):
+        if self.statusDisplayed:
+            print(ansi.cursor.up() + ansi.cursor.erase_line(), end='')
+            self.linesDisplayed -= 1
+        self.print(text)
+        self.statusDisplayed = True
 
     def clear(self):
         for i in range(self.linesDisplayed):
             print(ansi.cursor.up() + ansi.cursor.erase_line(), end='')
         self.linesDisplayed = 0
+        self.statusDisplayed = False
 
 class File:
     def __init__(self, file):
@@ -30,5 +43,8 @@ class File:
     def print(self, text=''):
         self.file.write(text + "\n")
 
+    def status(self, text):
+        pass
+
     def clear(self):
         pass
@@ -2,9 +2,41 @@
 
 # Format benchmark data for display.
 
-def statsHeader():
-    return "%-8s  %-8s  %-8s  %-6s  %-4s  %-8s  %-6s  %-7s" % (
-        "Min", "Mean", "Max", "CofV", "Runs", "Change", "%", "P-value")
+# If |adjusted| is set, show p-values adjusted for multiple comparisons
+# (q-values) in place of the raw p-values.
+
+def pvalueHeader(adjusted):
+    return "Q-value" if adjusted else "P-value"
+
+def formatPValue(comp, adjusted):
+    pvalue = comp.qvalue if adjusted else comp.pvalue
+    return "%7.2f" % pvalue if pvalue != None else ""
+
+# If |withDrift| is set, show the number of warm-up runs detected and any
+# shift in level during the runs. Warm-up runs that have been excluded
+# from the statistics are shown as a negative count.
+
+def driftHeader():
+    return "  %-4s  %-6s" % ("Warm", "Drift")
+
+def formatDrift(stats):
+    analysis = stats.analyseSequence()
+    warmup = ""
+    if stats.warmupExcluded:
+        warmup = "%4d" % -stats.warmupExcluded
+    elif analysis.warmup:
+        warmup = "%4d" % analysis.warmup
+    drift = "%+5.1f%%" % (analysis.drift * 100) if analysis.drift is not None else ""
+    return "  %4s  %6s" % (warmup, drift)
+
+def statsHeader(withIntervals = False, adjusted = False, withDrift = False):
+    header = "%-8s  %-8s  %-8s  %-6s  %-4s  %-8s  %-6s  %-7s" % (
+        "Min", "Mean", "Max", "CofV", "Runs", "Change", "%", pvalueHeader(adjusted))
+    if withDrift:
+        header += driftHeader()
+    if withIntervals:
+        header += "  %-17s  %-17s" % ("Mean 95% CI", "Median 95% CI")
+    return header
 
 def formatFloat(width, x):
     # General purpose number format that fits the most significant
@@ -19,31 +51,59 @@ def formatFloat(width, x):
         return s
     return "%*.*g" % (width, width - 5, x)
 
-def formatStats(stats, comp = None):
+# Intervals are for the change relative to the baseline.
+def formatInterval(interval):
+    if interval is None:
+        return ""
+    low, high = interval
+    return "%+.1f%%..%+.1f%%" % (low * 100, high * 100)
+
+def formatStats(stats, comp = None, withIntervals = False, adjusted = False,
+                withDrift = False):
     diff = formatFloat(8, comp.diff) if comp else ""
 
     percent = "%5.1f%%" % (comp.factor * 100) if comp and comp.factor != None else ""
-    pvalue = "%7.2f" % comp.pvalue if comp and comp.pvalue != None else ""
+    pvalue = formatPValue(comp, adjusted) if comp else ""
 
-    return "%8s  %8s  %8s  %5.1f%%  %4d  %8s  %6s  %7s" % (
+    line = "%8s  %8s  %8s  %5.1f%%  %4d  %8s  %6s  %7s" % (
         formatFloat(8, stats.min),
         formatFloat(8, stats.mean),
         formatFloat(8, stats.max),
         stats.cofv * 100, stats.count, diff, percent, pvalue)
 
-def compactStatsHeader(withComparison):
+    if withDrift:
+        line += formatDrift(stats)
+
+    if withIntervals:
+        meanInterval = formatInterval(comp.meanInterval) if comp else ""
+        medianInterval = formatInterval(comp.medianInterval) if comp else ""
+        line += "  %17s  %17s" % (meanInterval, medianInterval)
+
+    return line
+
+def compactStatsHeader(withComparison, withIntervals = False, adjusted = False,
+                       withDrift = False):
     header = "%-8s  %-6s" % ("Mean", "CofV")
+    if withDrift:
+        header += driftHeader()
     if withComparison:
-        header += "  %-6s  %-7s" % ("%", "P-value")
+        header += "  %-6s  %-7s" % ("%", pvalueHeader(adjusted))
+        if withIntervals:
+            header += "  %-17s" % "Mean 95% CI"
     return header
 
-def formatCompactStats(stats, comp = None):
+def formatCompactStats(stats, comp = None, withIntervals = False, adjusted = False,
+                       withDrift = False):
     line = "%8s  %5.1f%%" % (formatFloat(8, stats.mean), stats.cofv * 100)
+    if withDrift:
+        line += formatDrift(stats)
 
     if comp:
         percent = "%5.1f%%" % (comp.factor * 100) if comp.factor != None else ""
-        pvalue = "%7.2f" % comp.pvalue if comp.pvalue != None else ""
+        pvalue = formatPValue(comp, adjusted)
         line += "  %6s  %7s" % (percent, pvalue)
+        if withIntervals:
+            line += "  %17s" % formatInterval(comp.meanInterval)
 
     return line
 
@@ -0,0 +1,156 @@
+# gccache
+#
+# On-disk cache of parsed GC profiles.
+#
+# Entries are keyed by a hash of the profile file's contents and hold the
+# parsed slice tables in NumPy's binary format, so re-analysing a profile
+# skips parsing the text. The least recently used entries are evicted when
+# the cache grows beyond its size limit.
+
+import hashlib
+import io
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import numpy as np
+
+from slicetable import SliceTable
+
+# Bump this when the parsed representation changes.
+CacheVersion = 1
+
+DefaultMaxSize = 2 * 1024 * 1024 * 1024
+
+def defaultCacheDir():
+    base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'mozutils', 'gcprofile')
+
+# Whether |source| is a file we can hash and so can cache.
+def isCacheable(source):
+    if not isinstance(source, io.IOBase):
+        return False
+    name = getattr(source, 'name', None)
+    return isinstance(name, str) and os.path.isfile(name) and source.tell() == 0
+
+def hashFile(path):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f'gcprofile-cache-{CacheVersion}'.encode())
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+class ProfileCache:
+    def __init__(self, path = None, maxSize = DefaultMaxSize):
+        self.path = path or defaultCacheDir()
+        self.maxSize = maxSize
+
+    # Generate (kind, table) pairs for |source| using |parser|, loading
+    # them from the cache if possible. The parser's categories and test
+    # count are updated as if it had parsed the source.
+    def tables(self, parser, source):
+        key = hashFile(source.name)
+        entry = os.path.join(self.path, key)
+        if os.path.isdir(entry):
+            # Load the whole entry before yielding anything, so that if it
+            # is damaged or evicted part way through nothing is yielded
+            # twice.
+            try:
+                tables = self.load(parser, entry)
+            except (OSError, ValueError, KeyError):
+                # Fall back to parsing if the entry is damaged or was
+                # removed while we were reading it.
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                yield from tables
+                return
+
+        yield from self.store(parser, source, entry)
+
+    # Return a list of (kind, table) pairs for a cache entry.
+    def load(self, parser, entry):
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+
+        # Touch the entry so it counts as recently used.
+        os.utime(entry)
+
+        for name, values in meta['categories'].items():
+            categories = parser.categories[name]
+            for value in values:
+                categories.code(tuple(value) if isinstance(value, list) else value)
+        parser.testCount = meta['testCount']
+        parser.sliceCount = meta['sliceCount']
+
+        tables = []
+        for kind, name in meta['chunks']:
+            with np.load(os.path.join(entry, name)) as data:
+                columns = {column: data[column] for column in data.files}
+            tables.append((kind, SliceTable(columns, parser.categories)))
+        return tables
+
+    def store(self, parser, source, entry):
+        os.makedirs(self.path, exist_ok=True)
+        tempDir = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        try:
+            chunks = []
+            for kind, table in parser.parseTables(source):
+                name = f'chunk-{len(chunks):05d}.npz'
+                np.savez(os.path.join(tempDir, name), **table.columns)
+                chunks.append((kind, name))
+                yield kind, table
+
+            meta = {
+                'testCount': parser.testCount,
+                'sliceCount': parser.sliceCount,
+                'categories': {name: categories.values
+                               for name, categories in parser.categories.items()},
+                'chunks': chunks
+            }
+            with open(os.path.join(tempDir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+
+            try:
+                os.rename(tempDir, entry)
+            except OSError:
+                pass  # Another process stored this profile first.
+        finally:
+            shutil.rmtree(tempDir, ignore_errors=True)
+
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits within
+    # its size limit. Each entry is renamed out of the way before it is
+    # deleted so that other processes never see it partly removed; a reader
+    # that has already started on it fails to open the next file and falls
+    # back to parsing.
+    def evict(self):
+        entries = []
+        totalSize = 0
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(file.stat().st_size for file in os.scandir(entry))
+                entries.append((os.stat(entry).st_mtime, size, entry))
+            except FileNotFoundError:
+                continue
+            totalSize += size
+
+        entries.sort()
+        for _, size, entry in entries:
+            if totalSize <= self.maxSize:
+                break
+            doomed = tempfile.mkdtemp(dir=self.path, prefix='.evict-')
+            try:
+                os.rename(entry, os.path.join(doomed, 'entry'))
+            except OSError:
+                pass  # Another process evicted it first.
+            shutil.rmtree(doomed, ignore_errors=True)
+            totalSize -= size
@@ -1,185 +1,365 @@
 # gcprofile
 #
 # Summarise GC profiling information from log data.
+#
+# Profile data is processed incrementally so that arbitrarily large logs
+# can be summarised in bounded memory. Functions that take a |source|
+# accept a string, a file object or any other iterable of lines.
 
+import concurrent.futures
+import io
+import itertools
 import re
+import numpy as np
+
+import gccache
+import nursery
+from sketch import QuantileSketch
+from slicetable import SliceTableBuilder, createCategories
 
 # Detect whether we're currently running a raptor test, or between
 # tests.
 StartTestText = 'Testing url'
 EndTestText = 'PageCompleteCheck returned true'
 
-def summariseProfile(text, result, filterMostActiveRuntime = True):
-    majorFields, majorData, minorFields, minorData, testCount = parseOutput(text)
-
-    if filterMostActiveRuntime:
-        runtime = findMostActiveRuntimeByFrequency(majorData + minorData)
-        majorData = filterByRuntime(majorData, runtime)
-        minorData = filterByRuntime(minorData, runtime)
-
-    countMajorGCs(result, majorFields, majorData)
-
-    summariseAllData(result, majorFields, majorData, minorFields, minorData)
-    if testCount != 0:
-        summariseAllDataByInTest(result, majorFields, majorData, minorFields, minorData, True)
-
-    findFirstMajorGC(result, majorFields, majorData)
+PhaseFieldNames = ['bgwrk', 'waitBG', 'prep', 'mark', 'sweep', 'cmpct']
 
-    summarisePhaseTimes(result, majorFields, majorData)
+# Columns for which we record the distribution of per-slice times.
+DistributionFields = {
+    'MajorGC': ['total'] + PhaseFieldNames,
+    'MinorGC': ['total']
+}
 
-def findFirstMajorGC(result, majorFields, majorData):
-    timestampField = majorFields.get('Timestamp')
-    sizeField = majorFields.get('SizeKB')
-    timeField = majorFields.get('total')
-    statesField = majorFields.get('States')
+Percentiles = [50, 90, 99]
 
-    for line in majorData:
-        # Skip collections where we don't collect anything.
-        if int(line[timeField]) == 0 and line[statesField] == "0 -> 0":
-            continue
-
-        result['First major GC'] = float(line[timestampField])
-        result['Heap size / KB at first major GC'] = int(line[sizeField])
-        break
+# Number of slices converted to a table at a time.
+ChunkSize = 65536
 
-def summarisePhaseTimes(result, majorFields, majorData):
-    reasonField = majorFields.get('Reason')
-    fieldNames = ['bgwrk', 'waitBG', 'prep', 'mark', 'sweep', 'cmpct']
-    fields = [majorFields.get(name) for name in fieldNames]
-    totals = [0 for name in fieldNames]
-
-    for line in majorData:
-        if isShutdownReason(line[reasonField]):
-            continue
-        for i in range(len(fields)):
-            value = line[fields[i]]
-            if value:
-                totals[i] += int(value)
-
-    for i in range(len(fields)):
-        key = 'Total major GC time in phase ' + fieldNames[i]
-        result[key] = totals[i]
-
-def countMajorGCs(result, majorFields, majorData):
-    statesField = majorFields.get('States')
-    reasonField = majorFields.get('Reason')
+# Summarise GC activity in a profile, by default for the most active
+# runtime only. If |perRuntime| is set the summary covers all runtimes and
+# is followed by a summary for each runtime in order of GC time, up to
+# |maxRuntimes| of them.
+#
+# If a gccache.ProfileCache is passed as |cache| then profile files are
+# only parsed the first time they are seen.
+def summariseProfile(source, result, filterMostActiveRuntime = True,
+                     perRuntime = False, maxRuntimes = None, cache = None,
+                     nurseryAnalysis = False, perTest = False):
+    summary = createProfileSummary(source, cache)
+    writeProfileSummary(summary, result, filterMostActiveRuntime, perRuntime, maxRuntimes,
+                        nurseryAnalysis, perTest)
+
+# Write the result keys for |summary|. If |perTest| is set this includes
+# totals for each raptor test, and if |nurseryAnalysis| is set the detailed
+# nursery statistics from the nursery module.
+def writeProfileSummary(summary, result, filterMostActiveRuntime = True,
+                        perRuntime = False, maxRuntimes = None, nurseryAnalysis = False,
+                        perTest = False):
+    runtimes = None
+    if perRuntime:
+        summary.writeByRuntime(result, maxRuntimes)
+    else:
+        if filterMostActiveRuntime:
+            runtimes = [summary.findMostActiveRuntime()]
+        summary.write(result, runtimes)
+
+    if perTest:
+        summary.writeByTest(result, runtimes)
+
+    if nurseryAnalysis:
+        nursery.summariseNursery(summary, result, runtimes)
+
+def createProfileSummary(source, cache = None):
+    parser = ProfileParser()
+    summary = ProfileSummary()
+    for kind, table in readTables(parser, source, cache):
+        summary.add(kind, table)
+
+    summary.testCount = parser.testCount
+    return summary
+
+# Summarise several profile files in parallel, returning a list of
+# mergeable summaries. Each summary is restricted to the file's most active
+# runtime unless |filterMostActiveRuntime| is false.
+def summariseProfileFiles(paths, jobs = None, filterMostActiveRuntime = True,
+                          cache = None):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(summariseProfileFile, paths,
+                                 itertools.repeat(filterMostActiveRuntime),
+                                 itertools.repeat(cache)))
+
+def summariseProfileFile(path, filterMostActiveRuntime = True, cache = None):
+    with open(path) as f:
+        summary = createProfileSummary(f, cache)
 
-    count = 0
-    for line in majorData:
-        if "0 ->" in line[statesField] and not isShutdownReason(line[reasonField]):
-            count += 1
+    if filterMostActiveRuntime:
+        summary = summary.select([summary.findMostActiveRuntime()])
 
-    result['Major GC count'] = count
+    return summary
 
-def isShutdownReason(reason):
-    return 'SHUTDOWN' in reason or 'DESTROY' in reason or reason == 'ROOTS_REMOVED'
+def mergeProfileSummaries(summaries):
+    merged = ProfileSummary()
+    for summary in summaries:
+        merged.merge(summary)
+    return merged
 
-def extractHeapSizeData(text):
-    majorFields, majorData, _, _, _ = parseOutput(text)
+def extractHeapSizeData(source, cache = None):
+    runtimes = dict()
+    for key, timestamp, size in generateHeapSizes(source, cache):
+        if key not in runtimes:
+            runtimes[key] = list()
+        runtimes[key].append((timestamp, size))
 
-    pidField = majorFields.get('PID')
-    runtimeField = majorFields.get('Runtime')
-    timestampField = majorFields.get('Timestamp')
-    sizeField = majorFields.get('SizeKB')
-    assert pidField is not None
-    assert runtimeField is not None
-    assert sizeField is not None
+    return runtimes
 
-    runtimes = dict()
+# Generate (runtime, timestamp, size) for each major GC slice in |source|,
+# with timestamps adjusted to a common timeline. The first entry for each
+# runtime has a size of zero and marks when it started.
+def generateHeapSizes(source, cache = None):
+    parser = ProfileParser()
+    runtimeNames = parser.categories['runtime']
 
     # Estimate global time from times in previous traces.
     latestTimestamp = None
     startTimes = dict()
 
-    for line in majorData:
-        key = (line[pidField], line[runtimeField])
-        timestamp = float(line[timestampField])
-        size = int(line[sizeField])
+    for kind, table in readTables(parser, source, cache):
+        if kind != 'MajorGC':
+            continue
 
-        if key not in runtimes:
-            runtimes[key] = list()
-            if latestTimestamp is None:
-                startTimes[key] = 0
-                latestTimestamp = timestamp
-            else:
-                startTimes[key] = max(latestTimestamp - timestamp, 0)
-            runtimes[key].append((startTimes[key], 0))
+        assert 'SizeKB' in table
+        rows = zip(table['runtime'].tolist(),
+                   table['Timestamp'].tolist(),
+                   table['SizeKB'].tolist())
+        for runtime, timestamp, size in rows:
+            key = runtimeNames[runtime]
 
-        timestamp += startTimes[key]
-        latestTimestamp = timestamp
+            if key not in startTimes:
+                if latestTimestamp is None:
+                    startTimes[key] = 0
+                    latestTimestamp = timestamp
+                else:
+                    startTimes[key] = max(latestTimestamp - timestamp, 0)
+                yield key, startTimes[key], 0
 
-        runtimes[key].append((timestamp, size))
+            timestamp += startTimes[key]
+            latestTimestamp = timestamp
 
-    return runtimes
+            yield key, timestamp, int(size)
 
-def parseOutput(text):
-    majorFields = None
-    majorSpans = None
-    majorData = list()
-    minorFields = None
-    minorSpans = None
-    minorData = list()
+def isShutdownReason(reason):
+    return 'SHUTDOWN' in reason or 'DESTROY' in reason or reason == 'ROOTS_REMOVED'
 
-    inTest = False
-    testCount = 0
-    testNum = 0
+def isFullStoreBufferReason(reason):
+    return reason.startswith('FULL') and reason.endswith('BUFFER')
 
-    for line in text.splitlines():
-        if StartTestText in line:
-            assert not inTest
-            inTest = True
-            testCount += 1
-            testNum = testCount
-            continue
+def isReason(name):
+    return lambda reason: reason == name
 
-        if inTest and EndTestText in line:
-            inTest = False
-            testNum = 0
+# Check a partial summary against the baseline means for the same keys,
+# where |thresholds| maps keys to the factor by which they may exceed the
+# baseline. Returns a description of the first threshold exceeded, or None.
+def findExceededThreshold(result, baseline, thresholds):
+    for key, factor in thresholds.items():
+        if key not in result or not baseline.get(key):
             continue
+        if result[key] > factor * baseline[key]:
+            return (f"{key} of {result[key]:.0f} is more than {factor} times " +
+                    f"baseline of {baseline[key]:.0f}")
+    return None
+
+################################################################################
+# Following
+################################################################################
+
+# Follow a profile file while it is being written by a running process,
+# summarising new slices as they appear.
+class ProfileFollower:
+    def __init__(self, path, filterMostActiveRuntime = True):
+        self.path = path
+        self.filterMostActiveRuntime = filterMostActiveRuntime
+        self.file = None
+        self.partialLine = ''
+        self.parser = ProfileParser()
+        self.summary = ProfileSummary()
+
+    def poll(self):
+        if not self.file:
+            try:
+                self.file = open(self.path)
+            except FileNotFoundError:
+                return
+
+        text = self.file.read()
+        if not text:
+            return
+
+        lines = (self.partialLine + text).split('\n')
+        self.partialLine = lines.pop()
+        self.addLines(lines)
+
+    # Read the rest of the profile once the process has finished.
+    def finish(self):
+        self.poll()
+        if self.partialLine:
+            self.addLines([self.partialLine])
+            self.partialLine = ''
+        if self.file:
+            self.file.close()
+            self.file = None
+
+        assert self.parser.sliceCount != 0, "No profile data present"
+
+    def addLines(self, lines):
+        for kind, table in self.parser.parseTables(lines, False):
+            self.summary.add(kind, table)
+        self.summary.testCount = self.parser.testCount
+
+    def progress(self):
+        result = self.result()
+        return (f"{self.parser.sliceCount} slices, " +
+                f"GC time {result.get('Total GC time', 0):.0f} ms, " +
+                f"max heap {result.get('Max heap size / KB', 0)} KB")
+
+    def result(self):
+        result = dict()
+        if self.summary.runtimes:
+            writeProfileSummary(self.summary, result, self.filterMostActiveRuntime)
+        return result
+
+# The number of lines ProfileStream parses at once.
+StreamBatchSize = 4096
+
+# Summarise a profile from lines passed one at a time, such as the output
+# of a process as it runs. Only lines that may be part of the profile are
+# kept, and they are parsed in batches. Not thread safe, so the summary
+# should only be used once all lines have been added.
+class ProfileStream(ProfileFollower):
+    def __init__(self, filterMostActiveRuntime = True):
+        super().__init__(None, filterMostActiveRuntime)
+        self.pending = []
+
+    def addLine(self, line):
+        if 'GC:' in line or StartTestText in line or EndTestText in line:
+            self.pending.append(line)
+            if len(self.pending) == StreamBatchSize:
+                self.poll()
+
+    def poll(self):
+        if self.pending:
+            self.addLines(self.pending)
+            self.pending = []
+
+################################################################################
+# Parsing
+################################################################################
+
+# Generate (kind, table) pairs for the slices in |source|, using the cache
+# if there is one and the source is a file.
+def readTables(parser, source, cache = None):
+    if cache and gccache.isCacheable(source):
+        return cache.tables(parser, source)
+    return parser.parseTables(source)
+
+def readLines(source):
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    for line in source:
+        yield line.rstrip('\r\n')
+
+class ProfileParser:
+    def __init__(self):
+        self.majorFields = None
+        self.majorSpans = None
+        self.minorFields = None
+        self.minorSpans = None
+        self.inTest = False
+        self.testCount = 0
+        self.testNum = 0
+        self.sliceCount = 0
+        self.categories = createCategories()
+
+    # Generate a (kind, fields) pair for each slice in |source|, where
+    # kind is 'MajorGC' or 'MinorGC'. Field values are strings apart
+    # from the generated testNum field.
+    def parse(self, source, complete = True):
+        for line in readLines(source):
+            fields = self.parseLine(line)
+            if fields:
+                self.sliceCount += 1
+                yield fields
+
+        if complete:
+            assert self.sliceCount != 0, "No profile data present"
+
+    # Generate a (kind, table) pair for each chunk of up to ChunkSize
+    # slices in |source|. If |complete| is false then |source| is part of
+    # a profile and further parts may follow.
+    def parseTables(self, source, complete = True):
+        builders = dict()
+        for kind, fields in self.parse(source, complete):
+            if kind not in builders:
+                fieldMap = self.majorFields if kind == 'MajorGC' else self.minorFields
+                builders[kind] = SliceTableBuilder(fieldMap, self.categories)
+
+            builder = builders[kind]
+            builder.append(fields, self.sliceCount)
+            if len(builder) == ChunkSize:
+                yield kind, builder.build()
+
+        for kind, builder in builders.items():
+            if len(builder):
+                yield kind, builder.build()
+
+    def parseLine(self, line):
+        if StartTestText in line:
+            assert not self.inTest
+            self.inTest = True
+            self.testCount += 1
+            self.testNum = self.testCount
+            return None
+
+        if self.inTest and EndTestText in line:
+            self.inTest = False
+            self.testNum = 0
+            return None
 
         if 'MajorGC:' in line:
             line = line.split('MajorGC: ', maxsplit=1)[1]
 
             if 'TOTALS:' in line:
-                continue
+                return None
             elif line.startswith('PID'):
-                if not majorFields:
-                    majorFields, majorSpans = parseHeaderLine(line)
-                continue
-            else:
-                fields = splitWithSpans(line, majorSpans)
-
-            fields.append(testNum)
-            if len(fields) != len(majorFields):
-                print("Skipping garbled profile line")
-                continue
+                if not self.majorFields:
+                    self.majorFields, self.majorSpans = parseHeaderLine(line)
+                return None
 
-            majorData.append(fields)
-            continue
+            fields = self.splitFields(line, self.majorFields, self.majorSpans)
+            return ('MajorGC', fields) if fields else None
 
         if 'MinorGC:' in line:
             line = line.split('MinorGC: ', maxsplit=1)[1]
 
             if 'TOTALS:' in line:
-                continue
+                return None
             elif line.startswith('PID'):
-                if not minorFields:
-                    minorFields, minorSpans = parseHeaderLine(line)
-                continue
-            else:
-                fields = splitWithSpans(line, minorSpans)
+                if not self.minorFields:
+                    self.minorFields, self.minorSpans = parseHeaderLine(line)
+                return None
 
-            fields.append(testNum)
-            if len(fields) != len(minorFields):
-                print("Skipping garbled profile line")
-                continue
+            fields = self.splitFields(line, self.minorFields, self.minorSpans)
+            return ('MinorGC', fields) if fields else None
 
-            minorData.append(fields)
-            continue
+        return None
 
-    assert len(minorData) != 0 or len(majorData) != 0, "No profile data present"
+    def splitFields(self, line, fieldMap, spans):
+        fields = splitWithSpans(line, spans)
+        fields.append(self.testNum)
+        if len(fields) != len(fieldMap):
+            print("Skipping garbled profile line")
+            return None
 
-    return majorFields, majorData, minorFields, minorData, testCount
+        return fields
 
 def parseHeaderLine(line):
     fieldMap = dict()
@@ -191,7 +371,7 @@ def parseHeaderLine(line):
         fieldMap[name] = len(fieldMap)
         fieldSpans.append(span)
 
-    # Assumed by findMostActiveRuntime
+    # Assumed when grouping slices by runtime.
     assert fieldMap.get('PID') == 0
     assert fieldMap.get('Runtime') == 1
 
@@ -201,119 +381,331 @@ def parseHeaderLine(line):
     return fieldMap, fieldSpans
 
 def splitWithSpans(line, spans):
-    fields = []
-    for span in spans:
-        field = line[span[0]:span[1]].strip()
-        fields.append(field)
-
-    return fields
-
-def summariseAllDataByInTest(result, majorFields, majorData, minorFields, minorData, inTest):
-    majorData = filterByInTest(majorFields, majorData, inTest)
-    minorData = filterByInTest(minorFields, minorData, inTest)
-
-    suffix = ' in test' if inTest else ' outside test'
-
-    summariseAllData(result, majorFields, majorData, minorFields, minorData, suffix)
-
-def summariseAllData(result, majorFields, majorData, minorFields, minorData, keySuffix = ''):
-    summariseMajorMinorData(result, majorFields, majorData, minorFields, minorData, keySuffix)
-
-    result['Max heap size / KB' + keySuffix] = findMax(majorFields, majorData, 'SizeKB')
-
-    result['ALLOC_TRIGGER slices' + keySuffix] = \
-        len(filterByReason(majorFields, majorData, 'ALLOC_TRIGGER'))
-
-    result['TOO_MUCH_MALLOC slices' + keySuffix] = \
-        len(filterByReason(majorFields, majorData, 'TOO_MUCH_MALLOC'))
-
-    if minorData:
-        result['Full store buffer nursery collections' + keySuffix] = \
-            len(filterByFullStoreBufferReason(minorFields, minorData))
-
-        result['Mean full nusery promotion rate' + keySuffix] = \
-            meanPromotionRate(minorFields, filterByReason(minorFields, minorData, 'OUT_OF_NURSERY'))
-
-def summariseMajorMinorData(result, majorFields, majorData, minorFields, minorData, keySuffix):
-    majorCount, majorTime = summariseData(majorFields, majorData)
-    minorCount, minorTime = summariseData(minorFields, minorData)
-    minorTime /= 1000
-    totalTime = majorTime + minorTime
-    result['Major GC slices' + keySuffix] = majorCount
-    result['Major GC time' + keySuffix] = majorTime
-    result['Minor GC count' + keySuffix] = minorCount
-    result['Minor GC time' + keySuffix] = minorTime
-    result['Total GC time' + keySuffix] = majorTime + minorTime
-
-def summariseData(fieldMap, data):
-    count = 0
-    totalTime = 0
-    for fields in data:
-        count += 1
-        time = int(fields[fieldMap['total']])
-        totalTime += time
-    return count, totalTime
-
-# Work out which runtime we're interested in. This is a heuristic that
-# may not always work.
-def findMostActiveRuntimeByFrequency(data):
-    lineCount = dict()
-    for fields in data:
-        runtime = (fields[0], fields[1])
-
-        if runtime not in lineCount:
-            lineCount[runtime] = 0
-
-        lineCount[runtime] += 1
-
-    mostActive = None
-    maxCount = 0
-    for runtime in lineCount:
-        if lineCount[runtime] > maxCount:
-            mostActive = runtime
-            maxCount = lineCount[runtime]
-
-    assert mostActive
-    return mostActive
-
-def filterByRuntime(data, runtime):
-    return list(filter(lambda f: f[0] == runtime[0] and f[1] == runtime[1], data))
-
-def filterByInTest(fields, data, inTest):
-    i = fields['testNum']
-    return list(filter(lambda f: (f[i] != 0) == inTest, data))
-
-def filterByReason(fields, data, reason):
-    i = fields['Reason']
-    return list(filter(lambda f: f[i] == reason, data))
-
-def filterByFullStoreBufferReason(fields, data):
-    i = fields['Reason']
-    return list(filter(lambda f: f[i].startswith('FULL') and f[i].endswith('BUFFER'), data))
-
-def meanPromotionRate(fields, data):
-    if len(data) == 0:
-        return 0
-
-    i = fields['PRate']
-    sum = 0
-    for line in data:
-        rate = line[i]
-        ensure(rate.endswith('%'), "Bad promotion rate" + rate)
-        rate = float(rate[:-1])
-        sum += rate
-
-    return sum / len(data)
-
-def findMax(fields, data, key):
-    i = fields[key]
-    result = 0
-
-    for line in data:
-        result = max(result, int(line[i]))
-
-    return result
-
-def ensure(condition, error):
-    if not condition:
-        sys.exit(error)
+    return [line[start:end].strip() for start, end in spans]
+
+################################################################################
+# Summaries
+################################################################################
+
+# The column holding the nursery size before collection. Older profiles
+# have a single Size column.
+def nurserySizeColumn(table):
+    for name in ['OldKB', 'Size']:
+        if name in table:
+            return name
+    return None
+
+# Add per-slice columns to minor GC tables whose sums are needed for nursery
+# analysis: the amount promoted and the promotion rate weighted by time.
+def addNurseryColumns(table):
+    if 'PRate' not in table:
+        return
+
+    table.columns['weightedPRate'] = table['PRate'] * table['total']
+
+    sizeColumn = nurserySizeColumn(table)
+    if sizeColumn:
+        table.columns['promotedKB'] = table['PRate'] / 100 * table[sizeColumn]
+
+# Totals for a group of slices.
+class GroupTotals:
+    def __init__(self):
+        self.count = 0
+        self.sums = dict()
+        self.maxima = dict()
+        self.gcStarts = 0
+        self.sketches = dict()
+
+        # Slice number, timestamp and heap size of the first major GC.
+        self.firstMajorGC = None
+
+    def sum(self, name):
+        return self.sums.get(name, 0)
+
+    def max(self, name):
+        return self.maxima.get(name, 0)
+
+    def merge(self, other, sketches = True):
+        self.count += other.count
+        for name, value in other.sums.items():
+            self.sums[name] = self.sums.get(name, 0) + value
+        for name, value in other.maxima.items():
+            self.maxima[name] = max(self.maxima.get(name, value), value)
+        self.gcStarts += other.gcStarts
+
+        if sketches:
+            for name, sketch in other.sketches.items():
+                if name not in self.sketches:
+                    self.sketches[name] = QuantileSketch()
+                self.sketches[name].merge(sketch)
+
+        if other.firstMajorGC is not None:
+            if self.firstMajorGC is None or other.firstMajorGC < self.firstMajorGC:
+                self.firstMajorGC = other.firstMajorGC
+
+# Slice totals for a profile grouped by runtime, test number and collection
+# reason. Slices outside tests have test number zero. All summary keys are
+# rolled up from these groups so the slice data is only traversed once.
+class ProfileSummary:
+    def __init__(self):
+        self.groups = {'MajorGC': dict(), 'MinorGC': dict()}
+        self.runtimes = []
+        self.testCount = 0
+
+    def add(self, kind, table):
+        categories = table.categories
+        reasonCount = max(len(categories['Reason']), 1)
+        testSpan = int(table['testNum'].max()) + 1
+        keys = table['runtime'].astype(np.int64) * testSpan + table['testNum']
+        keys = keys * reasonCount + table['Reason']
+
+        groupKeys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+        counts = np.bincount(inverse)
+        order = np.argsort(inverse, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        if kind == 'MinorGC':
+            addNurseryColumns(table)
+
+        columns = table.numericColumns()
+        sums = {name: np.bincount(inverse, weights=table[name]) for name in columns}
+        maxima = {name: np.maximum.reduceat(table[name][order], starts) for name in columns}
+        distributions = [name for name in DistributionFields[kind] if name in table]
+        ordered = {name: table[name][order] for name in distributions}
+
+        if kind == 'MajorGC':
+            starting = table.matches('States', lambda states: "0 ->" in states)
+            gcStarts = np.bincount(inverse, weights=starting)
+
+            # Skip collections where we don't collect anything.
+            collecting = (table['total'] != 0) | ~table.equals('States', "0 -> 0")
+            sliceNums = np.where(collecting, table['sliceNum'], np.iinfo(np.int64).max)
+            firstSlices = np.minimum.reduceat(sliceNums[order], starts)
+
+        groups = self.groups[kind]
+        for i, key in enumerate(groupKeys.tolist()):
+            runtime = categories['runtime'][key // reasonCount // testSpan]
+            testNum = key // reasonCount % testSpan
+            reason = categories['Reason'][key % reasonCount]
+
+            if runtime not in self.runtimes:
+                self.runtimes.append(runtime)
+
+            totals = GroupTotals()
+            totals.count = int(counts[i])
+            for name in columns:
+                totals.sums[name] = float(sums[name][i])
+                totals.maxima[name] = float(maxima[name][i])
+
+            for name in distributions:
+                values = ordered[name][starts[i]:starts[i] + counts[i]]
+                if name != 'total':
+                    # Only count slices where this phase ran.
+                    values = values[values > 0]
+                totals.sketches[name] = QuantileSketch()
+                totals.sketches[name].add(values)
+
+            if kind == 'MajorGC':
+                totals.gcStarts = int(gcStarts[i])
+                if firstSlices[i] != np.iinfo(np.int64).max:
+                    row = np.searchsorted(table['sliceNum'], firstSlices[i])
+                    totals.firstMajorGC = (int(firstSlices[i]),
+                                           table.value('Timestamp', row),
+                                           int(table['SizeKB'][row]))
+
+            group = (runtime, testNum, reason)
+            if group not in groups:
+                groups[group] = GroupTotals()
+            groups[group].merge(totals)
+
+    # Return a summary containing only the groups for |runtimes|.
+    def select(self, runtimes):
+        summary = ProfileSummary()
+        summary.runtimes = [runtime for runtime in self.runtimes if runtime in runtimes]
+        for kind, groups in self.groups.items():
+            summary.groups[kind] = {group: totals for group, totals in groups.items()
+                                    if group[0] in runtimes}
+        summary.testCount = self.testCount
+        return summary
+
+    def merge(self, other):
+        for runtime in other.runtimes:
+            if runtime not in self.runtimes:
+                self.runtimes.append(runtime)
+
+        for kind, groups in other.groups.items():
+            for group, totals in groups.items():
+                if group not in self.groups[kind]:
+                    self.groups[kind][group] = GroupTotals()
+                self.groups[kind][group].merge(totals)
+
+        self.testCount = max(self.testCount, other.testCount)
+
+    def reasons(self, kind, runtimes = None):
+        reasons = []
+        for runtime, _, reason in self.groups[kind]:
+            if (runtimes is None or runtime in runtimes) and reason not in reasons:
+                reasons.append(reason)
+        return reasons
+
+    # Roll up the groups for the selected runtimes, test state, reasons and
+    # test numbers. Quantile sketches are only merged if |sketches| is set.
+    def total(self, kind, runtimes = None, inTest = None, reason = None, tests = None,
+              sketches = False):
+        totals = GroupTotals()
+        for (groupRuntime, testNum, groupReason), group in self.groups[kind].items():
+            if runtimes is not None and groupRuntime not in runtimes:
+                continue
+            if inTest is not None and (testNum != 0) != inTest:
+                continue
+            if tests is not None and testNum not in tests:
+                continue
+            if reason is not None and not reason(groupReason):
+                continue
+            totals.merge(group, sketches)
+        return totals
+
+    def lineCount(self, runtime):
+        return (self.total('MajorGC', [runtime]).count +
+                self.total('MinorGC', [runtime]).count)
+
+    # Work out which runtime we're interested in. This is a heuristic that
+    # may not always work.
+    def findMostActiveRuntime(self):
+        mostActive = None
+        maxCount = 0
+        for runtime in self.runtimes:
+            count = self.lineCount(runtime)
+            if count > maxCount:
+                mostActive = runtime
+                maxCount = count
+
+        assert mostActive is not None
+        return mostActive
+
+    def gcTime(self, runtimes = None):
+        majorTime = self.total('MajorGC', runtimes).sum('total')
+        minorTime = self.total('MinorGC', runtimes).sum('total') / 1000
+        return majorTime + minorTime
+
+    def writeByRuntime(self, result, maxRuntimes = None):
+        self.write(result)
+
+        runtimes = sorted(self.runtimes, key=lambda runtime: self.gcTime([runtime]),
+                          reverse=True)
+        result['Runtime count'] = len(runtimes)
+
+        others = []
+        if maxRuntimes is not None:
+            runtimes, others = runtimes[:maxRuntimes], runtimes[maxRuntimes:]
+
+        # Key by rank rather than PID so results can be compared across runs.
+        for rank, runtime in enumerate(runtimes, 1):
+            runtimeResult = dict()
+            self.write(runtimeResult, [runtime])
+            for key, value in runtimeResult.items():
+                result[f'Runtime {rank} {key}'] = value
+
+        if others:
+            result['Other runtimes Total GC time'] = self.gcTime(others)
+
+    def write(self, result, runtimes = None):
+        notShutdown = lambda reason: not isShutdownReason(reason)
+        major = self.total('MajorGC', runtimes, reason=notShutdown, sketches=True)
+        result['Major GC count'] = major.gcStarts
+
+        self.writeSliceTotals(result, runtimes)
+        if self.testCount != 0:
+            self.writeSliceTotals(result, runtimes, True, ' in test')
+
+        self.writeFirstMajorGC(result, runtimes)
+
+        for name in PhaseFieldNames:
+            key = 'Total major GC time in phase ' + name
+            result[key] = int(major.sum(name))
+
+        writeDistribution(result, 'Major GC slice time', major.sketches.get('total'))
+        for name in PhaseFieldNames:
+            writeDistribution(result, f'Major GC phase {name} time', major.sketches.get(name))
+
+        minor = self.total('MinorGC', runtimes, sketches=True)
+        writeDistribution(result, 'Minor GC time', minor.sketches.get('total'), 1 / 1000)
+
+    # Write totals for each test, and for cold and warm page loads. This
+    # follows raptor's chimera mode where the first page load after the
+    # browser starts is cold and later ones are warm.
+    def writeByTest(self, result, runtimes = None):
+        for testNum in range(1, self.testCount + 1):
+            keySuffix = f' in test {testNum}'
+            self.writeSliceTotals(result, runtimes, None, keySuffix, [testNum])
+            self.writeFirstMajorGC(result, runtimes, keySuffix, [testNum])
+
+        cycles = self.testCycles()
+        coldTests = [cycle[0] for cycle in cycles]
+        warmTests = [testNum for cycle in cycles for testNum in cycle[1:]]
+        if warmTests:
+            self.writeSliceTotals(result, runtimes, None, ' in cold test', coldTests)
+            self.writeSliceTotals(result, runtimes, None, ' in warm tests', warmTests)
+
+    # Split the test numbers into browser cycles. A new cycle starts when
+    # none of the processes that collected during a test were seen earlier
+    # in the current cycle, as happens when raptor restarts the browser.
+    # Tests without any collections stay in the current cycle.
+    def testCycles(self):
+        testPids = {testNum: set() for testNum in range(1, self.testCount + 1)}
+        for groups in self.groups.values():
+            for (pid, _), testNum, _ in groups:
+                if testNum in testPids:
+                    testPids[testNum].add(pid)
+
+        cycles = []
+        cyclePids = set()
+        for testNum, pids in testPids.items():
+            if not cycles or (pids and not pids & cyclePids):
+                cycles.append([])
+                cyclePids = set()
+            cycles[-1].append(testNum)
+            cyclePids |= pids
+        return cycles
+
+    def writeFirstMajorGC(self, result, runtimes, keySuffix = '', tests = None):
+        firstMajorGC = self.total('MajorGC', runtimes, tests=tests).firstMajorGC
+        if firstMajorGC is not None:
+            _, timestamp, size = firstMajorGC
+            result['First major GC' + keySuffix] = timestamp
+            result['Heap size / KB at first major GC' + keySuffix] = size
+
+    def writeSliceTotals(self, result, runtimes, inTest = None, keySuffix = '', tests = None):
+        major = self.total('MajorGC', runtimes, inTest, tests=tests)
+        minor = self.total('MinorGC', runtimes, inTest, tests=tests)
+
+        majorTime = int(major.sum('total'))
+        minorTime = int(minor.sum('total')) / 1000
+        result['Major GC slices' + keySuffix] = major.count
+        result['Major GC time' + keySuffix] = majorTime
+        result['Minor GC count' + keySuffix] = minor.count
+        result['Minor GC time' + keySuffix] = minorTime
+        result['Total GC time' + keySuffix] = majorTime + minorTime
+
+        result['Max heap size / KB' + keySuffix] = int(major.max('SizeKB'))
+
+        for reason in ['ALLOC_TRIGGER', 'TOO_MUCH_MALLOC']:
+            slices = self.total('MajorGC', runtimes, inTest, isReason(reason), tests)
+            result[reason + ' slices' + keySuffix] = slices.count
+
+        if minor.count:
+            fullBuffer = self.total('MinorGC', runtimes, inTest, isFullStoreBufferReason, tests)
+            result['Full store buffer nursery collections' + keySuffix] = fullBuffer.count
+
+            full = self.total('MinorGC', runtimes, inTest, isReason('OUT_OF_NURSERY'), tests)
+            meanRate = full.sum('PRate') / full.count if full.count else 0
+            result['Mean full nusery promotion rate' + keySuffix] = meanRate
+
+def writeDistribution(result, key, sketch, scale = 1):
+    if not sketch:
+        return
+
+    for percentile in Percentiles:
+        result[f'{key} p{percentile}'] = sketch.quantile(percentile / 100) * scale
+    result[f'{key} max'] = sketch.max * scale
@@ -0,0 +1,117 @@
+# heapseries
+#
+# Heap size time series extracted from GC profiles.
+#
+# Series are stored in NumPy arrays and can be downsampled for plotting
+# with the Largest-Triangle-Three-Buckets algorithm (Steinarsson, 2013),
+# which preserves the visual shape of the data, and exported as CSV or a
+# compact binary file.
+
+import array
+import csv
+import numpy as np
+
+import gcprofile
+
+class HeapSeries:
+    def __init__(self, times, sizes):
+        assert len(times) == len(sizes)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.sizes = np.asarray(sizes, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.times)
+
+    def peak(self):
+        return float(self.sizes.max()) if len(self) else 0
+
+    # Least squares estimate of heap growth in KB per second.
+    def growthRate(self):
+        if len(self) < 2 or self.times[0] == self.times[-1]:
+            return 0
+        slope, _ = np.polyfit(self.times, self.sizes, 1)
+        return float(slope)
+
+    # Time in seconds for which the heap size was above |thresholdKB|,
+    # treating each size as holding until the next sample.
+    def timeAbove(self, thresholdKB):
+        if len(self) < 2:
+            return 0
+        intervals = np.diff(self.times)
+        return float(intervals[self.sizes[:-1] > thresholdKB].sum())
+
+    def downsample(self, count):
+        indices = lttb(self.times, self.sizes, count)
+        return HeapSeries(self.times[indices], self.sizes[indices])
+
+# Return a dictionary mapping (PID, Runtime) to HeapSeries for |source|.
+def extractHeapSeries(source, cache = None):
+    times = dict()
+    sizes = dict()
+    for key, timestamp, size in gcprofile.generateHeapSizes(source, cache):
+        if key not in times:
+            times[key] = array.array('d')
+            sizes[key] = array.array('d')
+        times[key].append(timestamp)
+        sizes[key].append(size)
+
+    return {key: HeapSeries(np.frombuffer(times[key]), np.frombuffer(sizes[key]))
+            for key in times}
+
+# Select indices of up to |count| points that preserve the shape of the
+# data. The first and last points are always kept.
+def lttb(x, y, count):
+    length = len(x)
+    if count >= length:
+        return np.arange(length)
+    assert count >= 3
+
+    indices = np.empty(count, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = length - 1
+
+    # Split the points between the first and last into buckets.
+    edges = np.linspace(1, length - 1, count - 1).astype(np.int64)
+
+    selected = 0
+    for i in range(count - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # The average of the next bucket is the third triangle vertex.
+        if i + 2 < count - 1:
+            nextStart, nextEnd = edges[i + 1], edges[i + 2]
+        else:
+            nextStart, nextEnd = length - 1, length
+        averageX = x[nextStart:nextEnd].mean()
+        averageY = y[nextStart:nextEnd].mean()
+
+        areas = np.abs((x[selected] - averageX) * (y[start:end] - y[selected]) -
+                       (x[selected] - x[start:end]) * (averageY - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+
+    return indices
+
+def writeCSV(file, seriesMap):
+    writer = csv.writer(file)
+    writer.writerow(['PID', 'Runtime', 'Time', 'SizeKB'])
+    for (pid, runtime), series in seriesMap.items():
+        for time, size in zip(series.times.tolist(), series.sizes.tolist()):
+            writer.writerow([pid, runtime, f'{time:.3f}', int(size)])
+
+# Write series to a NumPy .npz file with float64 times and uint32 sizes, for
+# loading into plotting tools with np.load.
+def writeBinary(path, seriesMap):
+    arrays = dict()
+    keys = list(seriesMap.keys())
+    arrays['keys'] = np.array([f'{pid} {runtime}' for pid, runtime in keys])
+    for i, key in enumerate(keys):
+        arrays[f'times{i}'] = seriesMap[key].times
+        arrays[f'sizes{i}'] = seriesMap[key].sizes.astype(np.uint32)
+    np.savez_compressed(path, **arrays)
+
+def summariseHeapSeries(series, result, thresholdKB = None, name = 'heap'):
+    result[f'Peak {name} size / KB'] = series.peak()
+    result[f'{name.capitalize()} growth rate / KB/s'] = series.growthRate()
+    if thresholdKB is not None:
+        result[f'Time with {name} above {thresholdKB} KB / s'] = series.timeAbove(thresholdKB)
@@ -0,0 +1,134 @@
+# history
+#
+# A store of benchmark results that persists across sessions.
+#
+# Every run is recorded with the build, its prefs or shell arguments, the
+# test, the options that affect the results, the time and the host, along
+# with the result samples it produced. Stored runs for a baseline build can
+# then be loaded instead of measuring the baseline again.
+#
+# Runs recorded before the build's binaries were last modified are ignored
+# when loading, since they were made with a different build.
+
+import os
+import os.path
+import platform
+import sqlite3
+import time
+
+Schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    tool TEXT NOT NULL,
+    build TEXT NOT NULL,
+    prefs TEXT NOT NULL,
+    test TEXT NOT NULL,
+    options TEXT NOT NULL,
+    time REAL NOT NULL,
+    host TEXT NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS runsByBuild ON runs (tool, build, prefs, test, options, host);
+CREATE TABLE IF NOT EXISTS samples (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    key TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samplesByRun ON samples (run);
+'''
+
+# Options that change the results, so must match for stored runs to be
+# used. Options that only affect how results are displayed are not
+# included.
+BenchcompOptions = ['gc_profile', 'perf_counters', 'jobs', 'cores_per_job', 'stable_env',
+                    'drop_caches', 'stable_cores']
+RaptalyserOptions = ['page_cycles', 'browser_cycles', 'post_startup_delay', 'use_replicates',
+                     'headless', 'webrender', 'visualmetrics', 'gc_profile',
+                     'gc_profile_via_raptor', 'no_nursery_profile', 'gc_per_runtime',
+                     'nursery_analysis', 'gc_per_test', 'perf_counters', 'stable_env',
+                     'drop_caches', 'stable_cores']
+
+# Options for the stable environment, which can be excluded to find runs
+# to compare its effect against.
+StableOptions = ['stable_env', 'drop_caches', 'stable_cores']
+
+def defaultHistoryPath():
+    base = os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share'))
+    return os.path.join(base, 'mozutils', 'history.sqlite')
+
+# Describe the options in |names| that are set in |args|, other than those
+# in |exclude|. Unset options are left out so that runs recorded before an
+# option existed still match.
+def describeOptions(args, names, exclude = ()):
+    words = []
+    for name in names:
+        if name in exclude:
+            continue
+        value = getattr(args, name, None)
+        if value is True:
+            words.append(name)
+        elif value:
+            words.append(f'{name}={value}')
+    return ' '.join(words)
+
+# Return the time the build at |paths| was last modified, using whichever
+# of the paths exist.
+def buildTime(paths):
+    times = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+    return max(times) if times else None
+
+class History:
+    def __init__(self, path = None):
+        self.path = path or defaultHistoryPath()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(Schema)
+
+    def close(self):
+        self.db.close()
+
+    # Record a run's results, given as a list of (key, value) pairs since
+    # some keys have several samples per run.
+    def addRun(self, tool, build, prefs, test, options, samples, runTime = None,
+               host = None, source = None):
+        if not samples:
+            return
+
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (tool, build, prefs, test, options, time, host, source) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (tool, build, joinPrefs(prefs), test, options,
+                 runTime or time.time(), host or platform.node(), source))
+            run = cursor.lastrowid
+            self.db.executemany('INSERT INTO samples (run, key, value) VALUES (?, ?, ?)',
+                                [(run, key, float(value)) for key, value in samples])
+
+    # Return the samples for the most recent |maxRuns| matching runs made
+    # on this host after |since|, as a list of lists of (key, value) pairs
+    # in the order the runs were made.
+    def loadRuns(self, tool, build, prefs, test, options, since = None, maxRuns = None,
+                 host = None):
+        rows = self.db.execute(
+            'SELECT id FROM runs WHERE tool = ? AND build = ? AND prefs = ? AND test = ? '
+            'AND options = ? AND host = ? AND time >= ? ORDER BY time DESC, id DESC LIMIT ?',
+            (tool, build, joinPrefs(prefs), test, options, host or platform.node(),
+             since or 0, maxRuns if maxRuns is not None else -1)).fetchall()
+
+        runs = []
+        for (run,) in reversed(rows):
+            runs.append(self.db.execute(
+                'SELECT key, value FROM samples WHERE run = ? ORDER BY rowid',
+                (run,)).fetchall())
+        return runs
+
+    # Whether a run imported from |source| has already been recorded.
+    def hasSource(self, source):
+        row = self.db.execute('SELECT 1 FROM runs WHERE source = ? LIMIT 1',
+                              (source,)).fetchone()
+        return row is not None
+
+# Prefs are stored in a canonical order so that the order they were given
+# in doesn't matter.
+def joinPrefs(prefs):
+    return ' '.join(sorted(prefs))
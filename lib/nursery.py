@@ -0,0 +1,75 @@
+# nursery
+#
+# Analyse nursery collections from the MinorGC lines of GC profiles.
+#
+# The summary breaks down minor GC cost by collection reason and reports
+# how much is promoted to the tenured heap, weighting promotion rates by
+# collection time so that long collections count for more.
+
+import array
+import numpy as np
+
+import gcprofile
+import heapseries
+
+def summariseNursery(summary, result, runtimes = None):
+    minor = summary.total('MinorGC', runtimes)
+    if not minor.count:
+        return
+
+    writeNurseryTotals(result, 'Nursery', minor)
+
+    sizeColumn = 'NewKB' if 'NewKB' in minor.sums else 'Size'
+    if sizeColumn in minor.sums:
+        result['Nursery mean size / KB'] = minor.sum(sizeColumn) / minor.count
+        result['Nursery max size / KB'] = minor.max(sizeColumn)
+
+    totalTime = minor.sum('total')
+    for reason in summary.reasons('MinorGC', runtimes):
+        totals = summary.total('MinorGC', runtimes, reason=gcprofile.isReason(reason))
+        prefix = f'Nursery {reason}'
+        result[prefix + ' collections'] = totals.count
+        writeNurseryTotals(result, prefix, totals)
+        if totalTime:
+            result[prefix + ' share of time %'] = 100 * totals.sum('total') / totalTime
+
+def writeNurseryTotals(result, prefix, totals):
+    time = totals.sum('total')
+    result[prefix + ' time'] = time / 1000
+    result[prefix + ' mean time / us'] = time / totals.count if totals.count else 0
+
+    if 'weightedPRate' in totals.sums:
+        rate = totals.sum('weightedPRate') / time if time else 0
+        result[prefix + ' time-weighted promotion rate'] = rate
+
+    if 'promotedKB' in totals.sums:
+        promoted = totals.sum('promotedKB')
+        result[prefix + ' promoted KB'] = promoted
+        result[prefix + ' promoted KB per ms'] = promoted / (time / 1000) if time else 0
+
+# Return a dictionary mapping (PID, Runtime) to a HeapSeries of nursery
+# size after each minor GC.
+def extractNurserySeries(source, cache = None):
+    parser = gcprofile.ProfileParser()
+    runtimeNames = parser.categories['runtime']
+
+    times = dict()
+    sizes = dict()
+    for kind, table in gcprofile.readTables(parser, source, cache):
+        if kind != 'MinorGC':
+            continue
+
+        sizeColumn = 'NewKB' if 'NewKB' in table else gcprofile.nurserySizeColumn(table)
+        assert sizeColumn, "Profile has no nursery size column"
+
+        for runtime in np.unique(table['runtime']).tolist():
+            mask = table['runtime'] == runtime
+            key = runtimeNames[runtime]
+            if key not in times:
+                times[key] = array.array('d')
+                sizes[key] = array.array('d')
+            times[key].extend(table['Timestamp'][mask])
+            sizes[key].extend(table[sizeColumn][mask])
+
+    return {key: heapseries.HeapSeries(np.frombuffer(times[key]), np.frombuffer(sizes[key]))
+            for key in times}
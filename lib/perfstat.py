@@ -0,0 +1,106 @@
+# perfstat
+#
+# Collect performance counters for a command by running it under perf
+# stat.
+#
+# Hardware counters are not always available, for example in virtual
+# machines or when perf_event_paranoid is set, so this checks which events
+# can be counted and falls back to software events if necessary. Software
+# events can also be unavailable, for example if perf_event_open is blocked
+# by a seccomp filter, so they are checked too.
+
+import functools
+import shutil
+import subprocess
+
+HardwareEvents = ['instructions', 'cycles', 'branch-misses', 'cache-misses']
+SoftwareEvents = ['task-clock', 'page-faults', 'context-switches', 'cpu-migrations']
+
+EventKeys = {
+    'instructions': 'Instructions',
+    'cycles': 'Cycles',
+    'branch-misses': 'Branch misses',
+    'cache-misses': 'Cache misses',
+    'task-clock': 'Task clock / ms',
+    'page-faults': 'Page faults',
+    'context-switches': 'Context switches',
+    'cpu-migrations': 'CPU migrations'
+}
+
+@functools.lru_cache(maxsize=None)
+def findPerf():
+    return shutil.which('perf')
+
+# Return the list of events to count, or None if perf is not installed or
+# can't count any events.
+@functools.lru_cache(maxsize=None)
+def findEvents():
+    perf = findPerf()
+    if not perf:
+        return None
+
+    if len(probeEvents(perf, HardwareEvents)) == len(HardwareEvents):
+        return HardwareEvents + SoftwareEvents
+
+    return probeEvents(perf, SoftwareEvents) or None
+
+# Return those of |events| that perf can count.
+def probeEvents(perf, events):
+    proc = subprocess.run([perf, 'stat', '-x,', '-e', ','.join(events), '--', 'true'],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        return []
+
+    counts = parseCounters(proc.stderr)
+    return [event for event in events if event in counts]
+
+# Return an error message if performance counters can't be collected, or
+# None if they can.
+def checkAvailable():
+    if not findPerf():
+        return "Can't find perf"
+    if not findEvents():
+        return "perf can't count any events, check perf_event_paranoid"
+    return None
+
+# Return |cmd| wrapped to write counts in CSV format to |outputPath|.
+def wrapCommand(cmd, outputPath):
+    events = findEvents()
+    assert events, "perf not found"
+    return [findPerf(), 'stat', '-x,', '-o', outputPath, '-e', ','.join(events), '--'] + cmd
+
+# Read counts written by a command from wrapCommand and write result keys
+# for them to |result|.
+def readCounters(outputPath, result):
+    with open(outputPath) as f:
+        counts = parseCounters(f.read())
+
+    for event, count in counts.items():
+        if event in EventKeys:
+            result[EventKeys[event]] = count
+
+    if counts.get('cycles'):
+        result['Instructions per cycle'] = counts.get('instructions', 0) / counts['cycles']
+
+# Parse perf stat's CSV output into a map from event name to count. Lines
+# have the form: value,unit,event,run time,percentage,...
+def parseCounters(text):
+    counts = dict()
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split(',')
+        if len(fields) < 3:
+            continue
+
+        try:
+            value = float(fields[0])
+        except ValueError:
+            continue  # <not counted> or <not supported>
+
+        # Hybrid CPUs report events per core type, e.g. cpu_core/cycles/.
+        event = fields[2].split(':')[0].strip('/').split('/')[-1]
+        counts[event] = counts.get(event, 0) + value
+
+    return counts
@@ -0,0 +1,162 @@
+# proctree
+#
+# Control the lifetime of a process and all of its descendants.
+#
+# The process is started in its own session so the whole tree can be
+# killed with a single signal to its process group. Processes can leave
+# the group by starting a new session themselves, so if a cgroup v2
+# hierarchy is writable the tree is also put in its own cgroup. Killing the
+# cgroup reliably kills everything, and its accounting gives the CPU time
+# and peak memory of the whole tree.
+
+import itertools
+import os
+import signal
+import subprocess
+import time
+
+# Counter used to give each cgroup a unique name.
+CgroupSerial = itertools.count()
+
+class ProcessTree:
+    # Start the process with Popen arguments |kwargs|.
+    def __init__(self, cmd, **kwargs):
+        self.cgroup = createCgroup()
+        if self.cgroup:
+            # Join the cgroup before running the command so that no
+            # children can be started outside it.
+            procsPath = os.path.join(self.cgroup, 'cgroup.procs')
+            cmd = ['/bin/sh', '-c', 'echo $$ 2>/dev/null >"$0"; exec "$@"', procsPath] + cmd
+
+        self.proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+
+    # Kill every process in the tree.
+    def kill(self):
+        if self.cgroup:
+            killCgroup(self.cgroup)
+
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass  # The group has already exited.
+
+    # Write result keys for the CPU time and peak memory used by the whole
+    # tree, if known, to |result|.
+    #
+    # If the process couldn't join the cgroup, for example because writing
+    # to cgroup.procs was refused, the command still runs but outside it.
+    # Nothing ever runs in the cgroup then, so its CPU time is zero and
+    # nothing is written rather than reporting that as the tree's usage.
+    def writeUsage(self, result):
+        if not self.cgroup:
+            return
+
+        usage = 0
+        try:
+            with open(os.path.join(self.cgroup, 'cpu.stat')) as f:
+                for line in f:
+                    name, value = line.split()
+                    if name == 'usage_usec':
+                        usage = int(value)
+        except OSError:
+            pass
+
+        if not usage:
+            return
+
+        result['Process tree CPU time / s'] = usage / 1000000
+
+        try:
+            with open(os.path.join(self.cgroup, 'memory.peak')) as f:
+                result['Process tree peak memory / KB'] = int(f.read()) // 1024
+        except OSError:
+            pass  # The memory controller is not enabled for this cgroup.
+
+    # Kill anything left and remove the cgroup.
+    def close(self):
+        self.kill()
+        self.remove()
+
+    def remove(self):
+        if not self.cgroup:
+            return
+
+        # The cgroup can't be removed until its processes have exited.
+        for i in range(100):
+            try:
+                os.rmdir(self.cgroup)
+                break
+            except FileNotFoundError:
+                break
+            except OSError:
+                time.sleep(0.01)
+        self.cgroup = None
+
+# Create a cgroup under our own, or return None if that's not possible.
+def createCgroup():
+    parent = findOwnCgroup()
+    if not parent:
+        return None
+
+    path = os.path.join(parent, f'task-{os.getpid()}-{next(CgroupSerial)}')
+    try:
+        os.mkdir(path)
+    except OSError:
+        return None
+
+    # Enable memory accounting if our cgroup allows it. This fails if the
+    # parent cgroup has processes of its own.
+    try:
+        writeFile(os.path.join(parent, 'cgroup.subtree_control'), '+memory')
+    except OSError:
+        pass
+
+    return path
+
+def findOwnCgroup():
+    root = findCgroup2Mount()
+    if not root:
+        return None
+
+    with open('/proc/self/cgroup') as f:
+        for line in f:
+            hierarchy, _, path = line.rstrip('\n').split(':', 2)
+            if hierarchy == '0':
+                return os.path.join(root, path.lstrip('/'))
+    return None
+
+def findCgroup2Mount():
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                # The filesystem type follows the ' - ' separator.
+                fields, _, extra = line.partition(' - ')
+                if extra.split()[0] == 'cgroup2':
+                    return fields.split()[4]
+    except OSError:
+        pass
+    return None
+
+def killCgroup(path):
+    # cgroup.kill is available from Linux 5.14.
+    try:
+        writeFile(os.path.join(path, 'cgroup.kill'), '1')
+        return
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(path, 'cgroup.procs')) as f:
+            pids = [int(line) for line in f]
+    except OSError:
+        return
+
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+def writeFile(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
@@ -0,0 +1,98 @@
+# quiesce
+#
+# Wait for the system to become quiet before running a benchmark.
+#
+# Rather than sleeping for a fixed time, this samples /proc at short
+# intervals until CPU use, the number of runnable tasks and the amount of
+# dirty data waiting to be written back are all low, or until a timeout.
+# The CPU use measured while waiting is returned so it can be recorded with
+# the results.
+
+import os
+import time
+
+SampleInterval = 0.1  # seconds
+
+# The number of consecutive quiet samples required.
+QuietSamples = 3
+
+class Quiescence:
+    def __init__(self, quiet, waited, busy):
+        self.quiet = quiet    # Whether the system became quiet before the timeout.
+        self.waited = waited  # Time spent waiting in seconds.
+        self.busy = busy      # Fraction of CPU time in use over the last few samples.
+
+# Wait until the system is quiet. If |cores| is given only those cores are
+# checked for CPU use and the run queue is ignored, as when other
+# benchmarks are running on other cores.
+def waitForQuiet(cores = None, maxBusy = 0.1, maxRunnable = 1, maxDirtyKB = 4096,
+                 timeout = 10):
+    start = time.monotonic()
+    os.sync()
+
+    try:
+        history = [readCpuTimes(cores)]
+    except OSError:
+        # No /proc, so there's nothing to measure.
+        return Quiescence(True, time.monotonic() - start, 0)
+
+    quietCount = 0
+    while True:
+        time.sleep(SampleInterval)
+
+        history = history[-QuietSamples:] + [readCpuTimes(cores)]
+        quiet = (busyFraction(history[-2:]) <= maxBusy and
+                 readDirtyKB() <= maxDirtyKB)
+        if cores is None:
+            quiet = quiet and readRunnable() <= maxRunnable
+        quietCount = quietCount + 1 if quiet else 0
+
+        waited = time.monotonic() - start
+        if quietCount == QuietSamples:
+            return Quiescence(True, waited, busyFraction(history))
+        if waited >= timeout:
+            return Quiescence(False, waited, busyFraction(history))
+
+# Return the fraction of CPU time in use between the first and last of a
+# list of (idle, total) times.
+def busyFraction(history):
+    (firstIdle, firstTotal), (lastIdle, lastTotal) = history[0], history[-1]
+    if lastTotal <= firstTotal:
+        return 0
+    return 1 - (lastIdle - firstIdle) / (lastTotal - firstTotal)
+
+# Return the idle and total CPU time for |cores|, or for all cores if not
+# given, in clock ticks.
+def readCpuTimes(cores = None):
+    names = {'cpu'} if cores is None else {f'cpu{core}' for core in cores}
+    idle = 0
+    total = 0
+    with open('/proc/stat') as f:
+        for line in f:
+            if not line.startswith('cpu'):
+                break
+            fields = line.split()
+            if fields[0] not in names:
+                continue
+
+            # Guest time is already counted in user time, so skip it.
+            values = [int(value) for value in fields[1:9]]
+            idle += values[3] + values[4]  # idle and iowait
+            total += sum(values)
+    return idle, total
+
+# Return the number of runnable tasks, not counting this one.
+def readRunnable():
+    with open('/proc/loadavg') as f:
+        running, _ = f.read().split()[3].split('/')
+    return int(running) - 1
+
+# Return the amount of data waiting to be or being written back in KB.
+def readDirtyKB():
+    dirty = 0
+    with open('/proc/meminfo') as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            if name in ('Dirty', 'Writeback'):
+                dirty += int(value.split()[0])
+    return dirty
@@ -0,0 +1,68 @@
+# rusage
+#
+# Collect the resource usage of child processes.
+#
+# Commands are run through this module as a small shim process, which
+# starts the command, reaps it with os.wait4 and writes its resource usage
+# to a file. This avoids running it under /usr/bin/time.
+#
+# Linux counts the memory of the process that starts a child before the
+# child calls exec, so a child started directly by benchcomp would have
+# a maximum RSS no smaller than benchcomp's own, which grows as results
+# accumulate. Starting the command from the shim keeps this floor small and
+# the same for every run. The usage covers the command and any descendants
+# it waited for.
+
+import json
+import os
+import signal
+import sys
+
+# Return |cmd| wrapped to write its resource usage to |outputPath|.
+def wrapCommand(cmd, outputPath):
+    return [sys.executable, os.path.abspath(__file__), outputPath] + cmd
+
+# Read the usage written by a command from wrapCommand and write result
+# keys for it to |result|. Nothing is written if the command didn't finish.
+def readUsage(outputPath, result):
+    try:
+        with open(outputPath) as f:
+            usage = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    result['User time / s'] = usage['utime']
+    result['System time / s'] = usage['stime']
+    result['Max RSS / KB'] = usage['maxrss']
+    result['Major page faults'] = usage['majflt']
+    result['Minor page faults'] = usage['minflt']
+    result['Voluntary context switches'] = usage['nvcsw']
+    result['Involuntary context switches'] = usage['nivcsw']
+
+# Run the command given on the command line, then write its usage to the
+# output file and exit in the same way as the command.
+def main():
+    outputPath, *cmd = sys.argv[1:]
+    pid = os.posix_spawnp(cmd[0], cmd, os.environ)
+    _, status, rusage = os.wait4(pid, 0)
+
+    usage = {
+        'utime': rusage.ru_utime,
+        'stime': rusage.ru_stime,
+        'maxrss': rusage.ru_maxrss,
+        'majflt': rusage.ru_majflt,
+        'minflt': rusage.ru_minflt,
+        'nvcsw': rusage.ru_nvcsw,
+        'nivcsw': rusage.ru_nivcsw
+    }
+    with open(outputPath, 'w') as f:
+        json.dump(usage, f)
+
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+    sys.exit(os.waitstatus_to_exitcode(status))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# sketch
+#
+# A mergeable streaming quantile sketch.
+#
+# Values are counted in logarithmically sized buckets, so quantiles are
+# accurate to within a fixed relative error and memory use depends only on
+# the range of values seen, not on how many there are. This follows the
+# approach of DDSketch (Masson, Rim and Lee, 2019).
+
+import math
+import numpy as np
+
+class QuantileSketch:
+    def __init__(self, relativeAccuracy = 0.01, maxBuckets = 2048):
+        self.relativeAccuracy = relativeAccuracy
+        self.gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.logGamma = math.log(self.gamma)
+        self.maxBuckets = maxBuckets
+        self.buckets = dict()
+        self.zeroCount = 0
+        self.count = 0
+        self.max = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+
+        positive = values[values > 0]
+        self.zeroCount += len(values) - len(positive)
+        self.count += len(values)
+        self.max = max(self.max, float(values.max()))
+
+        indices = np.ceil(np.log(positive) / self.logGamma).astype(np.int64)
+        indices, counts = np.unique(indices, return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+        self.collapse()
+
+    def merge(self, other):
+        assert self.gamma == other.gamma
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeroCount += other.zeroCount
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        self.collapse()
+
+    # Merge the lowest buckets if there are too many, trading accuracy for
+    # small values to keep memory bounded.
+    def collapse(self):
+        if len(self.buckets) <= self.maxBuckets:
+            return
+
+        indices = sorted(self.buckets)
+        excess = len(indices) - self.maxBuckets
+        target = indices[excess]
+        for index in indices[:excess]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def quantile(self, q):
+        assert 0 <= q <= 1
+        if not self.count:
+            return 0
+
+        rank = q * (self.count - 1)
+        seen = self.zeroCount
+        if rank < seen:
+            return 0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(value, self.max)
+
+        return self.max
@@ -0,0 +1,150 @@
+# slicetable
+#
+# Columnar storage for parsed GC profile slices.
+#
+# Numeric columns are held in NumPy arrays and text columns as integer
+# codes into a shared list of categories. Values are converted once when
+# the table is built, after which filters and summaries operate on whole
+# columns at a time.
+
+import math
+import numpy as np
+
+# Columns stored as category codes rather than numbers.
+CategoricalFields = {'Reason', 'States'}
+
+# Fields that are combined into the generated 'runtime' column.
+RuntimeFields = {'PID', 'Runtime'}
+
+# Generated columns that don't hold profile data.
+GeneratedFields = {'testNum', 'sliceNum'}
+
+class Categories:
+    def __init__(self):
+        self.values = []
+        self.codes = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def find(self, value):
+        return self.codes.get(value, -1)
+
+    def matching(self, predicate):
+        return np.array([code for code in range(len(self.values))
+                         if predicate(self.values[code])], dtype=np.int32)
+
+class SliceTable:
+    def __init__(self, columns, categories):
+        self.columns = columns
+        self.categories = categories
+        self.length = len(next(iter(columns.values()))) if columns else 0
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def numericColumns(self):
+        return [name for name in self.columns
+                if name not in self.categories and name not in GeneratedFields]
+
+    # Mask of rows whose categorical column |name| equals |value|.
+    def equals(self, name, value):
+        return self.columns[name] == self.categories[name].find(value)
+
+    # Mask of rows whose categorical column |name| satisfies |predicate|.
+    def matches(self, name, predicate):
+        codes = self.categories[name].matching(predicate)
+        return np.isin(self.columns[name], codes)
+
+    def value(self, name, row):
+        value = self.columns[name][row]
+        if name in self.categories:
+            return self.categories[name][value]
+        return value.item()
+
+def createCategories():
+    categories = {name: Categories() for name in CategoricalFields}
+    categories['runtime'] = Categories()
+    return categories
+
+# Accumulate parsed rows of string fields and convert them to a table.
+class SliceTableBuilder:
+    def __init__(self, fieldMap, categories):
+        self.fieldMap = fieldMap
+        self.categories = categories
+        self.rows = []
+        self.sliceNums = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, fields, sliceNum):
+        self.rows.append(fields)
+        self.sliceNums.append(sliceNum)
+
+    def build(self):
+        values = list(zip(*self.rows))
+        columns = dict()
+
+        runtimes = self.categories['runtime']
+        columns['runtime'] = np.array(
+            [runtimes.code(runtime) for runtime in zip(values[0], values[1])],
+            dtype=np.int32)
+        columns['sliceNum'] = np.array(self.sliceNums, dtype=np.int64)
+
+        for name, index in self.fieldMap.items():
+            if name in RuntimeFields:
+                continue
+            elif name == 'testNum':
+                columns[name] = np.array(values[index], dtype=np.int32)
+            elif name in CategoricalFields:
+                categories = self.categories[name]
+                columns[name] = np.array(
+                    [categories.code(value) for value in values[index]],
+                    dtype=np.int32)
+            else:
+                columns[name] = parseNumericColumn(values[index])
+
+        self.rows = []
+        self.sliceNums = []
+        return SliceTable(columns, self.categories)
+
+def parseNumericColumn(values):
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        pass
+
+    # Try again after handling empty fields and percentages.
+    try:
+        return np.array([value.rstrip('%') or '0' for value in values], dtype=np.float64)
+    except ValueError:
+        return np.array([parseNumber(value) for value in values], dtype=np.float64)
+
+def parseNumber(text):
+    # Empty fields are phases that didn't run.
+    if not text:
+        return 0.0
+    if text.endswith('%'):
+        text = text[:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
@@ -0,0 +1,223 @@
+# stableenv
+#
+# Run benchmarks in an environment set up to reduce measurement noise.
+#
+# This disables address space randomisation for the benchmark, pins it to
+# cores isolated from the scheduler if there are any, sets the CPU
+# frequency governor to performance and turns off turbo boost, sets
+# environment variables that make the engine's behaviour more repeatable,
+# and optionally drops the page cache before each run.
+#
+# By default the benchmark is pinned to a single isolated core, which suits
+# single-threaded workloads. Pinning a multi-threaded workload to several
+# cores lets the kernel move its threads between them, since isolated cores
+# are not load balanced, so the number of cores is chosen explicitly.
+#
+# Each of these is only applied where the system allows it, and what was
+# applied is recorded so it can be stored with the results. System-wide
+# settings are restored when the process exits, including when it is
+# terminated by SIGTERM or SIGHUP.
+
+import atexit
+import functools
+import glob
+import os
+import platform
+import shutil
+import signal
+import subprocess
+
+import stats
+
+# Environment variables that remove sources of variation.
+FixedEnv = {
+    # Don't write poison values over freed GC memory.
+    'JSGC_DISABLE_POISONING': '1'
+}
+
+IsolatedCoresPath = '/sys/devices/system/cpu/isolated'
+GovernorPaths = '/sys/devices/system/cpu/cpu*/cpufreq/scaling_governor'
+NoTurboPath = '/sys/devices/system/cpu/intel_pstate/no_turbo'
+BoostPath = '/sys/devices/system/cpu/cpufreq/boost'
+DropCachesPath = '/proc/sys/vm/drop_caches'
+
+# Signals that terminate the process, after which system settings are
+# restored.
+RestoreSignals = [signal.SIGTERM, signal.SIGHUP]
+
+class StableEnvironment:
+    # If |pinCores| is false the benchmark is left on the cores it would
+    # otherwise run on, as when concurrent jobs are pinned separately.
+    # Otherwise it is pinned to the first |coreCount| isolated cores. If
+    # |dropCaches| is set the page cache is dropped before each run.
+    def __init__(self, pinCores = True, dropCaches = False, coreCount = 1):
+        self.env = dict(FixedEnv)
+        self.wrapper = []
+        self.saved = []
+
+        # A map from each setting to a description of what was done.
+        self.applied = dict()
+
+        setarch = findSetarch()
+        if setarch:
+            self.wrapper.extend(setarch)
+            self.applied['ASLR'] = 'disabled'
+        else:
+            self.applied['ASLR'] = 'not permitted'
+
+        cores = parseCoreList(readIsolatedCores())[:coreCount]
+        if not pinCores:
+            self.applied['Cores'] = 'pinned by job'
+        elif not cores or not shutil.which('taskset'):
+            self.applied['Cores'] = 'none isolated'
+        else:
+            cores = ','.join(str(core) for core in cores)
+            self.wrapper.extend([shutil.which('taskset'), '-c', cores])
+            self.applied['Cores'] = cores
+
+        self.applied['Governor'] = self.setGovernor('performance')
+        self.applied['Turbo'] = self.disableTurbo()
+        self.applied['Env'] = ' '.join(f'{name}={value}' for name, value in FixedEnv.items())
+        if dropCaches:
+            self.applied['Caches'] = 'dropped'
+
+        atexit.register(self.restore)
+        if self.saved:
+            for sig in RestoreSignals:
+                signal.signal(sig, self.handleSignal)
+
+    # Return |cmd| wrapped to run in the stable environment.
+    def wrapCommand(self, cmd):
+        return self.wrapper + cmd
+
+    # Called before each run.
+    def prepareRun(self):
+        if self.applied.get('Caches') == 'dropped':
+            os.sync()
+            try:
+                writeSetting(DropCachesPath, '3')
+            except OSError:
+                self.applied['Caches'] = 'not permitted'
+
+    def describe(self):
+        return ', '.join(f'{name}: {value}' for name, value in self.applied.items())
+
+    def setGovernor(self, governor):
+        paths = glob.glob(GovernorPaths)
+        if not paths:
+            return 'not available'
+        try:
+            for path in paths:
+                self.change(path, governor)
+        except OSError:
+            self.restore()
+            return 'not permitted'
+        return governor
+
+    def disableTurbo(self):
+        if os.path.exists(NoTurboPath):
+            path, value = NoTurboPath, '1'
+        elif os.path.exists(BoostPath):
+            path, value = BoostPath, '0'
+        else:
+            return 'not available'
+
+        try:
+            self.change(path, value)
+        except OSError:
+            return 'not permitted'
+        return 'disabled'
+
+    # Change a system setting, remembering its value so it can be restored.
+    def change(self, path, value):
+        old = readSetting(path)
+        writeSetting(path, value)
+        self.saved.append((path, old))
+
+    def restore(self):
+        for path, value in reversed(self.saved):
+            try:
+                writeSetting(path, value)
+            except OSError:
+                pass
+        self.saved = []
+
+    # Restore system settings and then terminate with the signal as before.
+    def handleSignal(self, sig, frame):
+        self.restore()
+        signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+
+# Return the command prefix that disables address space randomisation, or
+# None if this isn't possible. The personality call can be blocked, for
+# example in containers, so check that it works.
+@functools.lru_cache(maxsize=None)
+def findSetarch():
+    setarch = shutil.which('setarch')
+    if not setarch:
+        return None
+
+    prefix = [setarch, platform.machine(), '-R']
+    proc = subprocess.run(prefix + ['true'], stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+    return prefix if proc.returncode == 0 else None
+
+# Return the isolated cores as a list such as '2-3,6', or an empty string.
+def readIsolatedCores():
+    try:
+        return readSetting(IsolatedCoresPath)
+    except OSError:
+        return ''
+
+# Parse a core list such as '2-3,6' into a list of core numbers.
+def parseCoreList(text):
+    cores = []
+    for part in text.split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+def readSetting(path):
+    with open(path) as f:
+        return f.read().strip()
+
+def writeSetting(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+# Return a map from key to Stats for a list of runs loaded from the history.
+def statsForRuns(runs):
+    result = dict()
+    for run in runs:
+        for key, value in run:
+            if key not in result:
+                result[key] = stats.Stats()
+            result[key].add(value)
+    return result
+
+# Show the coefficient of variation for each key compared with that from
+# earlier runs made without the stable environment. |statsSets| and
+# |previousSets| hold a map from key to Stats for each build in |names|.
+def displayCofVReduction(out, names, statsSets, previousSets):
+    lines = []
+    for name, current, previous in zip(names, statsSets, previousSets):
+        for key in current:
+            if key not in previous or current[key].count < 2 or previous[key].count < 2:
+                continue
+            if previous[key].cofv == 0:
+                continue
+            change = current[key].cofv / previous[key].cofv - 1
+            lines.append("  %-40s  %-20s  %5.1f%%  %5.1f%%  %+6.1f%%" % (
+                key[-40:], name[-20:], previous[key].cofv * 100,
+                current[key].cofv * 100, change * 100))
+
+    if not lines:
+        return
+
+    out.print()
+    out.print("CofV compared with earlier runs without the stable environment:")
+    out.print("  %-40s  %-20s  %-6s  %-6s  %-7s" % ("", "", "Before", "After", "Change"))
+    for line in lines:
+        out.print(line)
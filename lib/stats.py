@@ -1,40 +1,100 @@
 # -*- coding: utf-8 -*-
 
 # Caclulate some basic statistics on a list of samples.
+#
+# Statistics are accumulated as samples are added so they can be updated
+# cheaply after each benchmark run. The mean and variance use Welford's
+# online algorithm, which avoids the loss of precision of summing squares.
 
+import array
 import math
+import numpy as np
+import re
+import weakref
 from scipy import stats
 
 class Stats:
-    def __init__(self, results):
-        self.count = len(results)
-        self.mean, self.stdv = Stats.meanstdv(results)
-        if self.mean:
-            self.cofv = self.stdv / self.mean
-        else:
-            self.cofv = 0
-        self.min = min(results)
-        self.max = max(results)
-        self.samples = results
-
-    def meanstdv(x):
-        assert(isinstance(x, list))
-
-        # from http://www.physics.rutgers.edu/~masud/computing/WPark_recipes_in_python.html
-        n, mean, std = len(x), 0, 0
-        for a in x:
-            mean = mean + a
-        mean = mean / float(n)
-        for a in x:
-            std = std + (a - mean) ** 2
-        if n > 1:
-            std = math.sqrt(std / float(n - 1))
+    def __init__(self, results = ()):
+        self.samples = array.array('d')
+        self.count = 0
+        self.mean = 0.0
+        self.sumSquares = 0.0  # Sum of squared differences from the mean.
+        self.min = None
+        self.max = None
+        # Comparisons with other Stats, which are forgotten when the other
+        # Stats is freed.
+        self.comparisons = weakref.WeakKeyDictionary()
+        self.analysis = None
+        self.steady = None
+        self.warmupExcluded = 0
+        for x in results:
+            self.add(x)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, x):
+        self.samples.append(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.sumSquares += delta * (x - self.mean)
+        if self.count == 1:
+            self.min = self.max = x
         else:
-            std = 0.0
-        return mean, std
+            self.min = min(self.min, x)
+            self.max = max(self.max, x)
+
+    @property
+    def stdv(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.sumSquares / (self.count - 1))
+
+    @property
+    def cofv(self):
+        if not self.mean:
+            return 0
+        return self.stdv / self.mean
 
+    # Compare with |other|, reusing the previous result if neither set of
+    # samples has changed since.
     def compareTo(self, other):
-        return compareStats(self, other)
+        if other is None or other is self:
+            return None
+
+        comp = self.cachedComparison(other)
+        if comp is None:
+            comp = compareStats(self, other)
+            self.cacheComparison(other, comp)
+        return comp
+
+    # Look for warm-up runs and level shifts in the order samples were
+    # added. The result is cached until more samples are added.
+    def analyseSequence(self):
+        if not self.analysis or self.analysis.count != self.count:
+            self.analysis = SequenceAnalysis(np.array(self.samples))
+        return self.analysis
+
+    # Return statistics for the samples after any warm-up runs.
+    def steadyState(self):
+        warmup = self.analyseSequence().warmup
+        if not warmup:
+            return self
+        if not self.steady or self.steady[0] != self.count:
+            steady = Stats(self.samples[warmup:])
+            steady.warmupExcluded = warmup
+            self.steady = (self.count, steady)
+        return self.steady[1]
+
+    def cachedComparison(self, other):
+        cached = self.comparisons.get(other)
+        if cached and cached[0] == self.count and cached[1] == other.count:
+            return cached[2]
+        return None
+
+    def cacheComparison(self, other, comp):
+        self.comparisons[other] = (self.count, other.count, comp)
 
 class Comparison:
     def __init__(self, diff, factor, pvalue):
@@ -42,7 +102,16 @@ class Comparison:
         self.factor = factor
         self.pvalue = pvalue
 
-def compareStats(a, b):
+        # The p-value adjusted for multiple comparisons, set by compareAll.
+        self.qvalue = None
+
+        # Bootstrap intervals for the change in mean and median as factors
+        # of the baseline, set by addBootstrapIntervals.
+        self.bootstrapped = False
+        self.meanInterval = None
+        self.medianInterval = None
+
+def compareStats(a, b, test = True):
     if b is None or a is b:
         return None
 
@@ -56,9 +125,394 @@ def compareStats(a, b):
     else:
         factor = diff / b.mean
 
-    if a.count > 1 and b.count > 1 and a.mean != b.mean:
-        p = stats.ttest_ind(a.samples, b.samples, equal_var=False, trim=0.2).pvalue
+    if test and canTest(a, b):
+        p = stats.ttest_ind(a.samples, b.samples, equal_var=False, trim=TrimProportion).pvalue
     else:
         p = None
 
     return Comparison(diff, factor, p)
+
+def canTest(a, b):
+    return a.count > 1 and b.count > 1 and a.mean != b.mean
+
+# Compare each pair of Stats (a, b) in |pairs| and return a list of the
+# comparisons. As with compareStats, the comparison is None if b is None or
+# is the same as a.
+#
+# Significance tests for all pairs are done at once, and the p-values are
+# then adjusted with the Benjamini-Hochberg procedure to control the false
+# discovery rate across all the pairs.
+def compareAll(pairs):
+    comps = []
+    groups = dict()
+    for a, b in pairs:
+        if b is None or a is b:
+            comps.append(None)
+            continue
+
+        comp = a.cachedComparison(b)
+        if comp is None:
+            comp = compareStats(a, b, False)
+            a.cacheComparison(b, comp)
+            if canTest(a, b):
+                groups.setdefault((a.count, b.count), []).append((a, b, comp))
+        comps.append(comp)
+
+    for group in groups.values():
+        pvalues = yuenTest(np.array([a.samples for a, _, _ in group]),
+                           np.array([b.samples for _, b, _ in group]))
+        for (_, _, comp), p in zip(group, pvalues.tolist()):
+            comp.pvalue = p if not math.isnan(p) else None
+
+    tested = [comp for comp in comps if comp and comp.pvalue is not None]
+    qvalues = adjustPValues(np.array([comp.pvalue for comp in tested]))
+    for comp, q in zip(tested, qvalues.tolist()):
+        comp.qvalue = q
+
+    return comps
+
+################################################################################
+# Vectorized significance tests
+################################################################################
+
+TrimProportion = 0.2
+
+# Yuen's trimmed mean version of Welch's t-test, comparing each row of
+# |a| with the corresponding row of |b|. This gives the same p-values as
+# stats.ttest_ind with equal_var=False and trim=TrimProportion.
+def yuenTest(a, b):
+    meanA, varA = trimmedMeanVariance(a)
+    meanB, varB = trimmedMeanVariance(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (meanA - meanB) / np.sqrt(varA + varB)
+        df = (varA + varB) ** 2 / (varA ** 2 / (trimmedCount(a) - 1) +
+                                   varB ** 2 / (trimmedCount(b) - 1))
+        return 2 * stats.t.sf(np.abs(t), df)
+
+def trimmedCount(x):
+    n = x.shape[1]
+    return n - 2 * int(n * TrimProportion)
+
+# Return the trimmed mean of each row of |x| and the squared standard
+# error of the trimmed mean based on the winsorized variance.
+def trimmedMeanVariance(x):
+    n = x.shape[1]
+    g = int(n * TrimProportion)
+    h = trimmedCount(x)
+    x = np.sort(x, axis=1)
+    mean = x[:, g:n - g].mean(axis=1)
+    winsorized = np.clip(x, x[:, g:g + 1], x[:, n - g - 1:n - g])
+    variance = winsorized.var(axis=1, ddof=1)
+    return mean, (n - 1) * variance / (h * (h - 1))
+
+# Benjamini-Hochberg adjustment of |pvalues|.
+def adjustPValues(pvalues):
+    m = len(pvalues)
+    if not m:
+        return pvalues
+    order = np.argsort(pvalues)
+    scaled = pvalues[order] * m / np.arange(1, m + 1)
+    adjusted = np.minimum.accumulate(scaled[::-1])[::-1]
+    qvalues = np.empty(m)
+    qvalues[order] = np.minimum(adjusted, 1)
+    return qvalues
+
+# Confidence interval for the mean of |a|.
+def meanInterval(a, confidence):
+    if a.count < 2:
+        return a.mean, a.mean
+    t = stats.t.ppf((1 + confidence) / 2, a.count - 1)
+    halfWidth = t * a.stdv / math.sqrt(a.count)
+    return a.mean - halfWidth, a.mean + halfWidth
+
+# Welch confidence interval for the difference between the means of |a|
+# and |b|.
+def differenceInterval(a, b, confidence):
+    diff = a.mean - b.mean
+    va = a.stdv ** 2 / a.count
+    vb = b.stdv ** 2 / b.count
+    if va + vb == 0:
+        return diff, diff
+
+    df = (va + vb) ** 2 / (va ** 2 / (a.count - 1) + vb ** 2 / (b.count - 1))
+    t = stats.t.ppf((1 + confidence) / 2, df)
+    halfWidth = t * math.sqrt(va + vb)
+    return diff - halfWidth, diff + halfWidth
+
+# Decide when enough runs have been made to stop. Results for a key are
+# settled once the difference from the baseline is significant, is known
+# to within |targetWidth| of the baseline mean, or is shown to be within
+# |tolerance| of it (two one-sided tests). Widths are fractions of the
+# mean.
+#
+# Checking after every run makes a false positive more likely than
+# |alpha| suggests, so this defaults to a stricter level than usual.
+#
+# Runs also stop once every build has |maxRuns| results, whether or not
+# they have settled, so the reason for stopping is reported.
+StopSettled = 'settled'
+StopAtLimit = 'limit'
+
+class StoppingRule:
+    def __init__(self, minRuns, maxRuns, alpha = 0.01, targetWidth = None, tolerance = None,
+                 keys = None):
+        assert 2 <= minRuns <= maxRuns
+        self.minRuns = minRuns
+        self.maxRuns = maxRuns
+        self.alpha = alpha
+        self.targetWidth = targetWidth
+        self.tolerance = tolerance
+        self.keys = re.compile(keys) if keys else None
+
+    def tracksKey(self, key):
+        return not self.keys or self.keys.search(key)
+
+    # Return why no more runs are needed for a key, given its Stats for
+    # each build with the baseline first, or None if more are needed.
+    def stopReason(self, statsForBuilds):
+        if any(stats.count < self.minRuns for stats in statsForBuilds):
+            return None
+
+        baseline = statsForBuilds[0]
+        if len(statsForBuilds) == 1:
+            settled = self.isPrecise(baseline)
+        else:
+            settled = all(self.isSettledComparison(stats, baseline)
+                          for stats in statsForBuilds[1:])
+        if settled:
+            return StopSettled
+
+        if all(stats.count >= self.maxRuns for stats in statsForBuilds):
+            return StopAtLimit
+
+        return None
+
+    def isPrecise(self, a):
+        if a.stdv == 0:
+            return True
+        if self.targetWidth is None:
+            return False
+        low, high = meanInterval(a, 1 - self.alpha)
+        return (high - low) / 2 <= self.targetWidth * abs(a.mean)
+
+    def isSettledComparison(self, a, b):
+        if a.stdv == 0 and b.stdv == 0:
+            return True
+
+        comp = a.compareTo(b)
+        if comp.pvalue is not None and comp.pvalue < self.alpha:
+            return True
+
+        scale = abs(b.mean)
+        if self.targetWidth is not None:
+            low, high = differenceInterval(a, b, 1 - self.alpha)
+            if (high - low) / 2 <= self.targetWidth * scale:
+                return True
+
+        if self.tolerance is not None:
+            low, high = differenceInterval(a, b, 1 - 2 * self.alpha)
+            margin = self.tolerance * scale
+            if -margin < low and high < margin:
+                return True
+
+        return False
+
+################################################################################
+# Bootstrap intervals
+################################################################################
+
+BootstrapResamples = 2000
+BootstrapSeed = 1729
+
+# Limit on the size of the intermediate resampled arrays.
+MaxResampleElements = 1 << 22
+
+# Add bootstrap confidence intervals for the change in mean and in median
+# to the comparison of each pair of Stats (a, b) in |pairs|.
+#
+# All pairs with the same sample counts are resampled together using the
+# same indices, generated from a seed that depends only on the counts, so
+# the results are reproducible. Intervals are stored on the cached
+# comparison and so are only recomputed when the samples change.
+def addBootstrapIntervals(pairs, confidence = 0.95, resamples = BootstrapResamples):
+    groups = dict()
+    for a, b in pairs:
+        comp = a.compareTo(b)
+        if comp is None or comp.bootstrapped:
+            continue
+        comp.bootstrapped = True
+        if a.count < 2 or b.count < 2:
+            continue
+        groups.setdefault((a.count, b.count), []).append((a, b, comp))
+
+    bounds = [(1 - confidence) / 2, (1 + confidence) / 2]
+    for (countA, countB), group in groups.items():
+        rng = np.random.default_rng([BootstrapSeed, countA, countB])
+        meansA, mediansA = resampleStatistics(
+            np.array([a.samples for a, _, _ in group]),
+            rng.integers(0, countA, size=(resamples, countA)))
+        meansB, mediansB = resampleStatistics(
+            np.array([b.samples for _, b, _ in group]),
+            rng.integers(0, countB, size=(resamples, countB)))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            meanIntervals = np.quantile(meansA / meansB - 1, bounds, axis=1)
+            medianIntervals = np.quantile(mediansA / mediansB - 1, bounds, axis=1)
+
+        for i, (_, b, comp) in enumerate(group):
+            if np.all(np.isfinite(meanIntervals[:, i])):
+                comp.meanInterval = tuple(meanIntervals[:, i].tolist())
+            if np.all(np.isfinite(medianIntervals[:, i])):
+                comp.medianInterval = tuple(medianIntervals[:, i].tolist())
+
+# Calculate the mean and median of each resample of each row of |samples|
+# given the |indices| to take for each resample.
+def resampleStatistics(samples, indices):
+    means = np.empty((len(samples), len(indices)))
+    medians = np.empty_like(means)
+    block = max(1, MaxResampleElements // indices.size)
+    for start in range(0, len(samples), block):
+        resampled = samples[start:start + block][:, indices]
+        means[start:start + block] = resampled.mean(axis=2)
+
+        # Sorting small rows is quicker than np.median's partitioning.
+        resampled.sort(axis=2)
+        middle = indices.shape[1] // 2
+        if indices.shape[1] % 2:
+            medians[start:start + block] = resampled[:, :, middle]
+        else:
+            medians[start:start + block] = (resampled[:, :, middle - 1] +
+                                            resampled[:, :, middle]) / 2
+    return means, medians
+
+################################################################################
+# Warm-up and changepoint detection
+################################################################################
+
+# Don't look for changes with fewer samples than this either side.
+MinSegmentLength = 3
+
+# Warm-up is only looked for in this many leading samples.
+MaxWarmupLength = 10
+
+WarmupAlpha = 0.05
+
+# How far from the steady-state mean, in standard deviations, each warm-up
+# sample must be.
+WarmupDeviations = 2.5
+ChangepointAlpha = 0.01
+
+class SequenceAnalysis:
+    def __init__(self, x):
+        self.count = len(x)
+
+        # The number of leading samples that look like warm-up runs.
+        self.warmup = warmupLength(x)
+
+        # The index of the first sample after a shift in level in the
+        # remaining samples, and the size of the shift relative to the
+        # earlier level.
+        self.changepoint = None
+        self.drift = None
+        changepoint = findChangepoint(x[self.warmup:])
+        if changepoint is not None:
+            before = x[self.warmup:self.warmup + changepoint].mean()
+            after = x[self.warmup + changepoint:].mean()
+            self.changepoint = self.warmup + changepoint
+            if before != 0:
+                self.drift = (after - before) / before
+
+# Find warm-up runs using the Marginal Standard Error Rule (White, 1997),
+# which chooses the truncation point that minimises the standard error of
+# the mean of the remaining samples. Truncation is limited to a short
+# leading window and is only accepted if the truncated samples differ
+# significantly from the rest, after a Bonferroni correction for the number
+# of truncation points tried.
+#
+# On its own MSER tends to overshoot, since dropping a steady-state sample
+# that happens to lie on the same side as the warm-up also lowers the
+# standard error. Each dropped sample must therefore lie more than
+# WarmupDeviations standard deviations from the steady-state mean, on the
+# same side as the first sample, and truncation stops at the first one
+# that doesn't.
+#
+# A shift in level part way through also looks like this, so the samples
+# straight after the truncation point must already be at the steady level.
+# Otherwise the shift is left for findChangepoint to report.
+def warmupLength(x):
+    n = len(x)
+    if n < 2 * MinSegmentLength:
+        return 0
+
+    # Sums of the remaining samples and their squares for each truncation.
+    remaining = np.arange(n, 0, -1)
+    sums = np.cumsum(x[::-1])[::-1]
+    squares = np.cumsum((x * x)[::-1])[::-1]
+    variances = squares / remaining - (sums / remaining) ** 2
+    candidates = min(n // 2, MaxWarmupLength)
+    errors = variances[:candidates] / remaining[:candidates]
+    d = int(np.argmin(errors))
+    if d == 0:
+        return 0
+
+    steady = x[d:]
+    following = steady[:max(d, MinSegmentLength)].mean()
+    if abs(following - steady.mean()) >= abs(following - x[:d].mean()):
+        return 0
+
+    stdv = steady.std(ddof=1)
+    if stdv == 0:
+        return d
+
+    deviations = (x[:d] - steady.mean()) / stdv
+    outside = deviations * np.sign(deviations[0]) > WarmupDeviations
+    d = int(np.argmin(outside)) if not outside.all() else d
+    if d == 0:
+        return 0
+
+    steady = x[d:]
+    stdv = steady.std(ddof=1)
+    t = (x[:d].mean() - steady.mean()) / (stdv * math.sqrt(1 / d + 1 / len(steady)))
+    p = 2 * stats.t.sf(abs(t), len(steady) - 1)
+    if p * candidates >= WarmupAlpha:
+        return 0
+
+    return d
+
+# Find the most likely single shift in the mean of |x| by minimising the
+# sum of squared deviations from the mean either side. The shift is only
+# reported if a t-test between the two sides is significant after a
+# Bonferroni correction for the number of positions tried.
+def findChangepoint(x):
+    n = len(x)
+    if n < 2 * MinSegmentLength:
+        return None
+
+    splits = np.arange(MinSegmentLength, n - MinSegmentLength + 1)
+    sums = np.cumsum(x)
+    squares = np.cumsum(x * x)
+    total, totalSquares = sums[-1], squares[-1]
+
+    before = splits
+    after = n - splits
+    sumBefore = sums[splits - 1]
+    sumAfter = total - sumBefore
+    sse = (squares[splits - 1] - sumBefore ** 2 / before +
+           (totalSquares - squares[splits - 1]) - sumAfter ** 2 / after)
+    best = int(np.argmin(sse))
+    k = int(splits[best])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = max(sse[best], 0) / (n - 2)
+        t = (sumAfter[best] / after[best] - sumBefore[best] / before[best]) / \
+            math.sqrt(variance * (1 / before[best] + 1 / after[best]))
+    # An exact step with no noise either side gives an infinite t, which is
+    # still a shift.
+    if math.isnan(t):
+        return None
+
+    p = 2 * stats.t.sf(abs(t), n - 2)
+    if p * len(splits) >= ChangepointAlpha:
+        return None
+
+    return k
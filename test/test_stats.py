@@ -0,0 +1,38 @@
+# Tests for the warm-up detection in lib/stats.py.
+
+import os.path
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import stats
+
+Trials = 300
+
+# Samples with |warmup| leading runs above a noisy steady state.
+def samplesWithWarmup(rng, count, warmup):
+    x = rng.normal(100, 1, count)
+    x[:len(warmup)] += warmup
+    return x
+
+def test_warmup_does_not_overshoot():
+    rng = np.random.default_rng(1729)
+    estimates = [stats.warmupLength(samplesWithWarmup(rng, 30, [8, 5, 4]))
+                 for i in range(Trials)]
+    overshoots = sum(1 for d in estimates if d > 3)
+    exact = sum(1 for d in estimates if d == 3)
+    assert overshoots <= Trials * 0.05
+    assert exact >= Trials * 0.8
+
+def test_no_warmup_in_steady_samples():
+    rng = np.random.default_rng(1729)
+    estimates = [stats.warmupLength(samplesWithWarmup(rng, 30, []))
+                 for i in range(Trials)]
+    assert sum(1 for d in estimates if d != 0) <= Trials * 0.05
+
+def test_level_shift_is_not_warmup():
+    analysis = stats.SequenceAnalysis(np.array([10.0] * 15 + [12.0] * 15))
+    assert analysis.warmup == 0
+    assert analysis.changepoint == 15